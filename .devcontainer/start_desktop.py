@@ -1,6 +1,10 @@
 import os
+import sys
 import subprocess
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import proc_control
+
 def run(cmd, check=True):
     print(f"Running: {cmd}")
     subprocess.run(cmd, shell=True, check=check)
@@ -32,7 +36,10 @@ def create_xstartup():
 
 def start_vnc():
     os.environ["USER"] = "root"
-    run("vncserver -kill :1", check=False)
+    # Wait for the old server to exit (SIGKILL if it won't) and clear its lock
+    # files, otherwise vncserver finds display :1 still in use
+    proc_control.terminate(proc_control.find_pids(proc_control.xvnc_pattern(1)))
+    proc_control.remove_display_files(1)
     run("vncserver :1")
 
 def start_novnc():
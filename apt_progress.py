@@ -0,0 +1,165 @@
+"""Streams the output of apt (or any install command) as one progress line.
+
+The child's output is read in large non-blocking chunks and appended as-is
+to a log file, while apt's "Get:", "Unpacking" and "Setting up" lines are
+counted to draw a progress bar with throughput and an ETA. The bar is
+redrawn at most a few times per second, so a chatty install never waits on
+the terminal. Errors and warnings are still printed as they come, and the
+tail of the output (plus where the full log is) is shown if the command fails.
+"""
+import collections
+import os
+import re
+import selectors
+import sys
+import time
+
+import timing
+
+CHUNK_SIZE = 64 * 1024
+RENDER_INTERVAL = 0.2       # seconds between progress bar redraws on a terminal
+STATUS_INTERVAL = 10        # seconds between status lines when not on a terminal
+TAIL_LINES = 30
+BAR_WIDTH = 24
+
+GET_LINE = re.compile(r"^Get:\d+ .*\[([\d.,]+) ([kMG]?B)\]$")
+# "Need to get X/Y of archives": X is what is left to download, Y counts the cached .debs too
+NEED_LINE = re.compile(r"^Need to get ([\d.,]+) ([kMG]?B)(?:/[\d.,]+ [kMG]?B)? of archives")
+SUMMARY_LINE = re.compile(r"^(\d+) upgraded, (\d+) newly installed, (\d+) to remove")
+UNITS = {"B": 1, "kB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3}
+
+def to_bytes(amount, unit):
+    return int(float(amount.replace(",", "")) * UNITS[unit])
+
+def format_bytes(n):
+    for unit in ("B", "kB", "MB"):
+        if n < 1000:
+            return f"{n:.0f} {unit}"
+        n /= 1000
+    return f"{n:.1f} GB"
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def new_progress():
+    return {
+        "started": time.monotonic(),
+        "packages": 0,          # packages the transaction installs or upgrades, once apt says
+        "download_bytes": 0,    # bytes apt said it needs to get
+        "fetched_bytes": 0,
+        "fetched": 0,
+        "unpacked": 0,
+        "set_up": 0,
+        "tail": collections.deque(maxlen=TAIL_LINES),
+    }
+
+def parse_line(progress, line):
+    """Update the counters from one line of output; True if it should be printed anyway"""
+    progress["tail"].append(line)
+    timing.parse_apt_output_line(line)
+    if line.startswith("Get:"):
+        progress["fetched"] += 1
+        match = GET_LINE.match(line)
+        if match:
+            progress["fetched_bytes"] += to_bytes(*match.groups())
+    elif line.startswith("Unpacking "):
+        progress["unpacked"] += 1
+    elif line.startswith("Setting up "):
+        progress["set_up"] += 1
+    elif match := NEED_LINE.match(line):
+        progress["download_bytes"] = to_bytes(*match.groups())
+    elif match := SUMMARY_LINE.match(line):
+        upgraded, installed, _ = match.groups()
+        progress["packages"] = int(upgraded) + int(installed)
+    return line.startswith(("E:", "W:", "Err:", "dpkg: error", "ERROR"))
+
+def fraction_done(progress):
+    """Overall progress: downloading is the first third, unpacking and setting up the rest
+    (when everything is already cached there is no download part)"""
+    parts = []
+    if progress["download_bytes"]:
+        parts.append((1, min(progress["fetched_bytes"] / progress["download_bytes"], 1)))
+    if progress["packages"]:
+        parts.append((1, min(progress["unpacked"] / progress["packages"], 1)))
+        parts.append((1, min(progress["set_up"] / progress["packages"], 1)))
+    if not parts:
+        return None
+    return sum(weight * done for weight, done in parts) / sum(weight for weight, _ in parts)
+
+def render(progress, now):
+    elapsed = now - progress["started"]
+    done = fraction_done(progress)
+    fields = []
+    if done is not None:
+        filled = int(done * BAR_WIDTH)
+        fields.append(f"[{'#' * filled}{'-' * (BAR_WIDTH - filled)}] {done:4.0%}")
+    if progress["packages"]:
+        fields.append(f"{progress['set_up']}/{progress['packages']} set up")
+    else:
+        fields.append(f"{progress['fetched']} fetched, {progress['set_up']} set up")
+    if progress["fetched_bytes"] and elapsed > 0:
+        fields.append(f"{format_bytes(progress['fetched_bytes'] / elapsed)}/s")
+    fields.append(format_duration(elapsed))
+    if done and 0.02 < done < 1:
+        fields.append(f"ETA {format_duration(elapsed / done - elapsed)}")
+    return "   " + "  ".join(fields)
+
+def stream(process, log_path):
+    """Consume process's stdout until it exits; returns its exit code"""
+    progress = new_progress()
+    tty = sys.stdout.isatty()
+    fd = process.stdout.fileno()
+    os.set_blocking(fd, False)
+    selector = selectors.DefaultSelector()
+    selector.register(fd, selectors.EVENT_READ)
+    pending = b""
+    last_render = 0 if tty else progress["started"]
+    line_shown = False
+    with open(log_path, "ab") as log:
+        while True:
+            ready = selector.select(timeout=RENDER_INTERVAL)
+            chunk = b""
+            if ready:
+                try:
+                    chunk = os.read(fd, CHUNK_SIZE)
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    break
+                log.write(chunk)
+                lines = (pending + chunk).replace(b"\r", b"\n").split(b"\n")
+                pending = lines.pop()
+                for raw in lines:
+                    line = raw.decode(errors="replace").strip()
+                    if line and parse_line(progress, line):
+                        print(("\r\033[K" if line_shown else "") + f"   {line}", flush=True)
+                        line_shown = False
+            now = time.monotonic()
+            if tty and now - last_render >= RENDER_INTERVAL:
+                sys.stdout.write("\r\033[K" + render(progress, now))
+                sys.stdout.flush()
+                last_render, line_shown = now, True
+            elif not tty and now - last_render >= STATUS_INTERVAL:
+                print(render(progress, now), flush=True)
+                last_render = now
+    selector.close()
+    if pending:
+        parse_line(progress, pending.decode(errors="replace").strip())
+    returncode = process.wait()
+
+    if line_shown:
+        sys.stdout.write("\r\033[K")
+    elapsed = time.monotonic() - progress["started"]
+    if returncode != 0:
+        print(f"   ❌ Failed with exit code {returncode} after {format_duration(elapsed)}, last output:")
+        for line in progress["tail"]:
+            print(f"      {line}")
+    else:
+        summary = f"{progress['set_up']} packages set up" if progress["set_up"] else f"{progress['fetched']} files fetched"
+        if progress["fetched_bytes"]:
+            summary += f", {format_bytes(progress['fetched_bytes'])} downloaded"
+        print(f"   ✅ Done in {format_duration(elapsed)} ({summary})")
+    if returncode != 0:
+        print(f"   📝 Full output: {log_path}")
+    return returncode
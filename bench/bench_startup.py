@@ -0,0 +1,343 @@
+"""Startup benchmark for desktop_toggle.py and delete_desktop.py.
+
+Runs the real main() functions against stand-ins: fake sudo, apt-get,
+apt-cache, dpkg, vncserver/Xvnc, vncpasswd, websockify and gio executables
+on PATH, a temporary HOME and a temporary dpkg status file
+(DESKTOP_DPKG_STATUS), so no Debian box, network or real VNC is needed. The
+fakes sleep for configurable delays and log every call.
+
+Each run measures three phases, every one in a fresh Python process:
+  cold      first start, every package missing
+  warm      second start, packages already provisioned
+  teardown  delete_desktop.py
+and records wall time, subprocesses spawned, calls to the fake tools and
+files written. The medians over all runs are compared against
+bench/baseline.json. Before that it checks that an extra session's
+vncserver command line carries every setting of the VNC config file.
+
+    python3 bench/bench_startup.py                  # compare against the baseline
+    python3 bench/bench_startup.py --save-baseline  # record a new baseline
+
+The fakes use the default desktop (display :1, ports 5901/6080), so stop any
+real desktop before running this.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+PHASES = ["cold", "warm", "teardown"]
+METRICS = ["wall_seconds", "subprocesses", "tool_calls", "files_written"]
+
+# Every fake starts with this: log the call (sudo is only a wrapper), then do its job
+FAKE_PRELUDE = '''import os, sys, time
+if os.path.basename(sys.argv[0]) != "sudo":
+    with open(os.environ["BENCH_CALL_LOG"], "a") as log:
+        log.write(os.path.basename(sys.argv[0]) + "\\n")
+def delay(name):
+    time.sleep(float(os.environ.get(name, "0")))
+'''
+
+FAKES = {
+    "sudo": '''
+args = sys.argv[1:]
+while args and "=" in args[0] and not args[0].startswith("-"):
+    key, value = args.pop(0).split("=", 1)
+    os.environ[key] = value
+os.execvp(args[0], args)
+''',
+    "apt-get": '''
+args = sys.argv[1:]
+if "update" in args:
+    delay("BENCH_APT_UPDATE_DELAY")
+    print("Fetched 2,048 kB in 0s (10.0 MB/s)")
+elif "install" in args and not {"-s", "--print-uris"} & set(args):
+    status_path = os.environ["DESKTOP_DPKG_STATUS"]
+    with open(status_path) as status:
+        installed = {line.split(":", 1)[1].strip() for line in status if line.startswith("Package:")}
+    packages = [arg for arg in args[args.index("install") + 1:] if not arg.startswith("-")
+                and "=" not in arg and not arg.startswith("Dir::") and arg not in installed]
+    # Like apt, leave dpkg's status alone when everything is already installed
+    if packages:
+        delay("BENCH_APT_INSTALL_DELAY")
+        with open(status_path, "a") as status:
+            for package in packages:
+                status.write(f"Package: {package}\\nStatus: install ok installed\\n\\n")
+        print(f"Fetched {len(packages) * 100} kB in 0s (10.0 MB/s)")
+''',
+    "apt-cache": '''
+for package in sys.argv[2:]:
+    print(f"{package}:\\n  Installed: (none)\\n  Candidate: 1.0-1")
+''',
+    "dpkg": "",
+    "gio": "",
+    "vncpasswd": '''
+sys.stdin.read()
+sys.stdout.buffer.write(b"\\x00" * 8)
+''',
+    "vncserver": '''
+import socket, subprocess
+display = next(arg for arg in sys.argv[1:] if arg.startswith(":"))
+port = 5900 + int(display[1:])
+if "-rfbport" in sys.argv:
+    port = int(sys.argv[sys.argv.index("-rfbport") + 1])
+xvnc = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Xvnc")
+proc = subprocess.Popen([sys.executable, xvnc, display, "-rfbport", str(port)],
+                        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL, start_new_session=True)
+os.makedirs(os.path.expanduser("~/.vnc"), exist_ok=True)
+with open(os.path.expanduser(f"~/.vnc/{socket.gethostname()}{display}.pid"), "w") as f:
+    f.write(f"{proc.pid}\\n")
+print(f"New Xtigervnc server '{socket.gethostname()}{display}' on port {port}")
+''',
+    "Xvnc": '''
+import signal, socket
+display = sys.argv[1][1:]
+port = int(sys.argv[sys.argv.index("-rfbport") + 1])
+lock_path, socket_path = f"/tmp/.X{display}-lock", f"/tmp/.X11-unix/X{display}"
+def cleanup(*_):
+    for path in (lock_path, socket_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    os._exit(0)
+signal.signal(signal.SIGTERM, cleanup)
+delay("BENCH_VNC_DELAY")
+with open(lock_path, "w") as f:
+    f.write(f"{os.getpid():>10}\\n")
+os.makedirs("/tmp/.X11-unix", exist_ok=True)
+x_socket = socket.socket(socket.AF_UNIX)
+x_socket.bind(socket_path)
+x_socket.listen()
+server = socket.create_server(("", port), reuse_port=True)
+while True:
+    conn, _ = server.accept()
+    conn.sendall(b"RFB 003.008\\n")
+    conn.close()
+''',
+    "websockify": '''
+import socket
+port = int(sys.argv[-2])
+delay("BENCH_PROXY_DELAY")
+server = socket.create_server(("", port), reuse_port=True)
+while True:
+    conn, _ = server.accept()
+    conn.recv(4096)
+    conn.sendall(b"HTTP/1.0 200 OK\\r\\nContent-Length: 0\\r\\n\\r\\n")
+    conn.close()
+''',
+}
+
+def install_fakes(bin_dir):
+    os.makedirs(bin_dir)
+    for name, body in FAKES.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(f"#!{sys.executable}\n" + FAKE_PRELUDE + body)
+        os.chmod(path, 0o755)
+
+def snapshot(root):
+    """{path: (mtime, size)} for every file under root, except the harness's own"""
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if dirpath == root and filename != "dpkg_status":
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (st.st_mtime_ns, st.st_size)
+    return files
+
+def files_written(before, after):
+    return sum(1 for path, stamp in after.items() if before.get(path) != stamp)
+
+def run_child(phase):
+    """Body of one phase, run inside the benchmark environment"""
+    sys.path.insert(0, REPO_DIR)
+    if phase == "teardown":
+        import delete_desktop
+        delete_desktop.main()
+        subprocesses = 0
+    else:
+        import desktop_toggle
+        import timing
+        desktop_toggle.main([])
+        subprocesses = timing.counters["subprocesses"]
+    with open(os.environ["BENCH_RESULT"], "w") as f:
+        json.dump({"subprocesses": subprocesses}, f)
+
+def run_phase(phase, root, env):
+    """Run one phase in a fresh interpreter and return its metrics"""
+    call_log, result_path = env["BENCH_CALL_LOG"], env["BENCH_RESULT"]
+    open(call_log, "w").close()
+    before = snapshot(root)
+    start = time.monotonic()
+    with open(os.path.join(root, f"{phase}.log"), "w") as log:
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", phase],
+                             env=env, stdout=log, stderr=subprocess.STDOUT, cwd=root).returncode
+    wall = time.monotonic() - start
+    if ret != 0:
+        raise Exception(f"{phase} phase failed (exit code {ret}), see {root}/{phase}.log")
+    with open(result_path) as f:
+        result = json.load(f)
+    with open(call_log) as f:
+        fake_calls = len(f.read().splitlines())
+    after = snapshot(root)
+    return {
+        "wall_seconds": round(wall, 3),
+        # Commands spawned directly, and calls to the fake tools however they were reached
+        "subprocesses": result["subprocesses"],
+        "tool_calls": fake_calls,
+        "files_written": files_written(before, after),
+    }
+
+def benchmark_run(args):
+    """One cold start, warm start and teardown in a fresh environment"""
+    root = tempfile.mkdtemp(prefix="desktop_toggle_bench_")
+    home = os.path.join(root, "home")
+    os.makedirs(home)
+    install_fakes(os.path.join(root, "bin"))
+    open(os.path.join(root, "dpkg_status"), "w").close()
+    env = dict(os.environ,
+               HOME=home,
+               PATH=os.path.join(root, "bin") + os.pathsep + os.environ.get("PATH", ""),
+               DESKTOP_DPKG_STATUS=os.path.join(root, "dpkg_status"),
+               DESKTOP_PROFILE=args.profile,
+               BENCH_CALL_LOG=os.path.join(root, "calls.log"),
+               BENCH_RESULT=os.path.join(root, "result.json"),
+               BENCH_APT_UPDATE_DELAY=str(args.apt_update_delay),
+               BENCH_APT_INSTALL_DELAY=str(args.apt_install_delay),
+               BENCH_VNC_DELAY=str(args.vnc_delay),
+               BENCH_PROXY_DELAY=str(args.proxy_delay))
+    for key in ("DESKTOP_APT_CACHE", "DESKTOP_LAZY", "DESKTOP_PRESET", "DESKTOP_PROXY", "DESKTOP_TRACE"):
+        env.pop(key, None)
+    try:
+        return {phase: run_phase(phase, root, env) for phase in PHASES}
+    finally:
+        # Never leave fake servers behind, even if a phase failed
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "teardown"],
+                       env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=root)
+        if args.keep:
+            print(f"   (kept {root})")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+def missing_session_settings():
+    """Config file settings an extra session's vncserver command line doesn't pass.
+
+    vncserver only reads ~/.vnc/config, so for any session but the default
+    one the command line is the only way the settings reach Xvnc.
+    """
+    sys.path.insert(0, REPO_DIR)
+    import desktop_toggle
+    import sessions
+    with tempfile.TemporaryDirectory() as state_dir:
+        session = dict(sessions.make_session("bench", 2), state_dir=state_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            desktop_toggle.create_vnc_config("lan", session)
+        with open(os.path.join(state_dir, "config")) as f:
+            keys = [line.split("=")[0] for line in f if "=" in line and not line.startswith("#")]
+    vnc_cmd = desktop_toggle.vnc_command("lan", session)
+    return [key for key in keys if f"-{key}" not in vnc_cmd and not any(arg.startswith(f"-{key}=") for arg in vnc_cmd)]
+
+def desktop_in_use():
+    if os.path.exists("/tmp/.X1-lock") or os.path.exists("/tmp/.X11-unix/X1"):
+        return True
+    for port in (5901, 6080):
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return True
+    return False
+
+def medians(runs):
+    return {phase: {metric: statistics.median(run[phase][metric] for run in runs) for metric in METRICS}
+            for phase in PHASES}
+
+def compare(results, baseline, tolerance):
+    """Print results next to the baseline and return the list of regressions"""
+    regressions = []
+    print(f"\n{'PHASE':<10}{'METRIC':<15}{'RESULT':>10}{'BASELINE':>10}{'CHANGE':>9}")
+    for phase in PHASES:
+        for metric in METRICS:
+            value = results[phase][metric]
+            base = baseline.get(phase, {}).get(metric)
+            change = f"{(value - base) / base:+.0%}" if base else ""
+            print(f"{phase:<10}{metric:<15}{value:>10}{'' if base is None else base:>10}{change:>9}")
+            if base is None:
+                continue
+            # Timings get some slack for noise, counts have to match exactly
+            limit = base * (1 + tolerance) if metric == "wall_seconds" else base
+            if value > limit:
+                regressions.append(f"{phase} {metric}: {value} (baseline {base})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark desktop startup and teardown against fake apt/VNC tools")
+    parser.add_argument("--runs", type=int, default=3, help="runs to take the median of (default: 3)")
+    parser.add_argument("--profile", default="full", help="install profile to start (default: full)")
+    parser.add_argument("--apt-update-delay", type=float, default=0.2, help="seconds a fake apt-get update takes")
+    parser.add_argument("--apt-install-delay", type=float, default=0.5, help="seconds a fake apt-get install takes")
+    parser.add_argument("--vnc-delay", type=float, default=0.2, help="seconds the fake Xvnc takes to come up")
+    parser.add_argument("--proxy-delay", type=float, default=0.1, help="seconds the fake websockify takes to come up")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help=f"baseline file (default: {BASELINE_PATH})")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed wall time regression (default: 0.25)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directories for inspection")
+    parser.add_argument("--child", choices=PHASES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    missing = missing_session_settings()
+    if missing:
+        print(f"❌ Extra sessions don't get these VNC settings: {', '.join(missing)}")
+        exit(1)
+
+    if desktop_in_use():
+        print("❌ Display :1 or ports 5901/6080 are in use. Stop the desktop first (python3 delete_desktop.py)")
+        exit(1)
+
+    runs = []
+    for i in range(args.runs):
+        print(f"🏃 Run {i + 1}/{args.runs}...")
+        runs.append(benchmark_run(args))
+    results = medians(runs)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"\n💾 Baseline saved to {args.baseline}")
+    elif regressions:
+        print("\n❌ Regressions against the baseline:")
+        for regression in regressions:
+            print(f"   • {regression}")
+        exit(1)
+    elif baseline:
+        print("\n✅ No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
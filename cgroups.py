@@ -0,0 +1,146 @@
+"""Optional cgroup v2 limits per desktop session (--cgroups).
+
+Each session gets two cgroups under <root>/desktop-toggle/<session>:
+  display  Xvnc and the proxy, with a high CPU weight and protected memory,
+           so the picture keeps updating while apps are busy
+  apps     the XFCE session and everything started from it, with a normal
+           CPU weight and an optional memory limit, so a runaway browser tab
+           gets throttled (or OOM-killed) instead of freezing the session
+The root is the cgroup v2 mount (or DESKTOP_CGROUP_ROOT, e.g. a subtree
+systemd delegated to the user). Inside a container that root is only the
+container's own cgroup and already holds processes, which cgroup v2 doesn't
+allow next to child cgroups with controllers, so they are moved to an
+"init" leaf first. Anything that can't be set up is reported and skipped;
+the desktop still starts without limits.
+"""
+import errno
+import os
+
+PARENT_NAME = "desktop-toggle"
+CONTROLLERS = ["cpu", "memory"]
+DISPLAY_MEMORY_LOW = "256M"     # memory the display cgroup keeps even under pressure
+LEAF_NAME = "init"              # where processes already in the root are moved
+
+def find_root():
+    """Mount point of the cgroup v2 hierarchy, or None"""
+    if os.environ.get("DESKTOP_CGROUP_ROOT"):
+        return os.environ["DESKTOP_CGROUP_ROOT"]
+    try:
+        with open("/proc/self/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if fields[2] == "cgroup2":
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+def session_dir(root, name):
+    return os.path.join(root, PARENT_NAME, name)
+
+def read_value(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def write_value(path, value):
+    with open(path, "w") as f:
+        f.write(str(value))
+
+def enable_controllers(path):
+    """Let the children of path use the cpu and memory controllers"""
+    available = (read_value(os.path.join(path, "cgroup.controllers")) or "").split()
+    missing = [c for c in CONTROLLERS if c not in available]
+    if missing:
+        raise Exception(f"{path} doesn't offer the {', '.join(missing)} controller(s)")
+    enabled = (read_value(os.path.join(path, "cgroup.subtree_control")) or "").split()
+    if all(c in enabled for c in CONTROLLERS):
+        return
+    subtree_control = os.path.join(path, "cgroup.subtree_control")
+    try:
+        write_value(subtree_control, " ".join(f"+{c}" for c in CONTROLLERS))
+    except OSError as e:
+        if e.errno != errno.EBUSY:
+            raise
+        # path has processes of its own (a container's cgroup root does)
+        move_to_leaf(path)
+        write_value(subtree_control, " ".join(f"+{c}" for c in CONTROLLERS))
+
+def move_to_leaf(path):
+    """Move every process in path itself into its init child cgroup"""
+    leaf = os.path.join(path, LEAF_NAME)
+    os.makedirs(leaf, exist_ok=True)
+    for pid in (read_value(os.path.join(path, "cgroup.procs")) or "").split():
+        try:
+            move(pid, leaf)
+        except OSError:
+            pass    # exited in the meantime, or a kernel thread
+
+def setup(name, display_cpu_weight=1000, apps_cpu_weight=100, apps_memory_max="max"):
+    """Create the session's display and apps cgroups; returns their paths"""
+    root = find_root()
+    if not root:
+        raise Exception("no cgroup v2 hierarchy is mounted")
+    parent = os.path.join(root, PARENT_NAME)
+    session = session_dir(root, name)
+    display, apps = os.path.join(session, "display"), os.path.join(session, "apps")
+    try:
+        enable_controllers(root)
+        os.makedirs(display, exist_ok=True)
+        os.makedirs(apps, exist_ok=True)
+        enable_controllers(parent)
+        enable_controllers(session)
+        write_value(os.path.join(display, "cpu.weight"), display_cpu_weight)
+        write_value(os.path.join(display, "memory.low"), DISPLAY_MEMORY_LOW)
+        write_value(os.path.join(apps, "cpu.weight"), apps_cpu_weight)
+        write_value(os.path.join(apps, "memory.max"), apps_memory_max)
+    except OSError as e:
+        raise Exception(f"can't configure {session} ({e.strerror}); run as root or delegate a "
+                        f"cgroup subtree and point DESKTOP_CGROUP_ROOT at it")
+    return display, apps
+
+def move(pid, path):
+    write_value(os.path.join(path, "cgroup.procs"), pid)
+
+def remove(name):
+    """Remove a stopped session's cgroups (they must be empty by now)"""
+    root = find_root()
+    if not root:
+        return
+    session = session_dir(root, name)
+    for path in (os.path.join(session, "display"), os.path.join(session, "apps"), session):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+def usage(path):
+    """Current usage and limits of one cgroup"""
+    cpu_stat = dict(line.split() for line in (read_value(os.path.join(path, "cpu.stat")) or "").splitlines())
+    events = dict(line.split() for line in (read_value(os.path.join(path, "memory.events")) or "").splitlines())
+    procs = (read_value(os.path.join(path, "cgroup.procs")) or "").split()
+    memory_current = read_value(os.path.join(path, "memory.current"))
+    return {
+        "processes": len(procs),
+        "cpu_weight": read_value(os.path.join(path, "cpu.weight")),
+        "cpu_seconds": int(cpu_stat.get("usage_usec", 0)) / 1e6,
+        "memory_mb": int(memory_current) / 1e6 if memory_current else 0,
+        "memory_max": read_value(os.path.join(path, "memory.max")),
+        "oom_kills": int(events.get("oom_kill", 0)),
+    }
+
+def list_sessions():
+    """{session name: {"display": usage, "apps": usage}} for every session with cgroups"""
+    root = find_root()
+    if not root or not os.path.isdir(os.path.join(root, PARENT_NAME)):
+        return {}
+    result = {}
+    for name in sorted(os.listdir(os.path.join(root, PARENT_NAME))):
+        session = session_dir(root, name)
+        if os.path.isdir(session):
+            result[name] = {slice_name: usage(os.path.join(session, slice_name))
+                            for slice_name in ("display", "apps")
+                            if os.path.isdir(os.path.join(session, slice_name))}
+    return result
@@ -0,0 +1,75 @@
+"""Idempotent writers for the config files the desktop generates.
+
+Every file is rendered in full first and compared (by SHA-256) with what is
+already on disk. Only files whose content changed are written, via a temp
+file and os.replace so a crash never leaves a half-written config, and only
+those get their permissions and other metadata applied. On a warm restart
+nothing has changed, so nothing is written.
+"""
+import hashlib
+import os
+import stat
+import tempfile
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(path):
+    try:
+        with open(path, "rb") as f:
+            return content_hash(f.read())
+    except OSError:
+        return None
+
+def current_umask():
+    # os.umask can only be read by setting it, which would race with the
+    # other startup threads creating files, so ask /proc instead
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+def write_if_changed(path, content, mode=None):
+    """Atomically write content to path unless it's already there; True if written.
+
+    mode is applied to new or changed files, and fixed up on an unchanged
+    file only if it differs (a single stat, no write). Without a mode a
+    changed file keeps its permissions and a new one gets the same as
+    open(path, "w") would give it (mkstemp's default is 0600).
+    """
+    data = content.encode() if isinstance(content, str) else content
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    if st is not None and st.st_size == len(data) and file_hash(path) == content_hash(data):
+        if mode is not None and stat.S_IMODE(st.st_mode) != mode:
+            os.chmod(path, mode)
+        return False
+
+    if mode is None:
+        mode = stat.S_IMODE(st.st_mode) if st is not None else 0o666 & ~current_umask()
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            os.fchmod(f.fileno(), mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
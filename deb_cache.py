@@ -0,0 +1,108 @@
+"""Persistent .deb cache shared across environment rebuilds (--apt-cache DIR).
+
+apt's archive directory is pointed at DIR/archives, so any .deb already there
+is used instead of being downloaded again. DIR/index.json records every
+cached .deb by its package_version_arch file name, with its size, SHA-256 and
+when a transaction last used it. After each run the cache is pruned back
+under its size cap, least recently used first, and the hit rate is reported.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+
+INST_LINE = re.compile(r"^Inst (\S+) (?:\[[^\]]*\] )?\((\S+) .*\[([^\]]+)\]\)")
+
+def archives_dir(cache_dir):
+    return os.path.join(os.path.abspath(cache_dir), "archives")
+
+def index_path(cache_dir):
+    return os.path.join(os.path.abspath(cache_dir), "index.json")
+
+def apt_options(cache_dir):
+    return f"-o Dir::Cache::Archives={archives_dir(cache_dir)}/"
+
+def prepare(cache_dir):
+    os.makedirs(os.path.join(archives_dir(cache_dir), "partial"), exist_ok=True)
+
+def load_index(cache_dir):
+    try:
+        with open(index_path(cache_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_index(cache_dir, index):
+    tmp_path = index_path(cache_dir) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, index_path(cache_dir))
+
+def deb_filename(name, version, arch):
+    """The file name apt stores a package version under (epoch colon is escaped)"""
+    name = name.split(":", 1)[0]  # drop a multi-arch qualifier like wine32:i386
+    return f"{name}_{version.replace(':', '%3a')}_{arch}.deb"
+
+def planned_debs(simulate_output):
+    """File names of every .deb an `apt-get install -s` transaction will install"""
+    planned = []
+    for line in simulate_output.splitlines():
+        match = INST_LINE.match(line)
+        if match:
+            planned.append(deb_filename(*match.groups()))
+    return planned
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def count_hits(cache_dir, planned):
+    archive_dir = archives_dir(cache_dir)
+    return sum(1 for filename in planned if os.path.exists(os.path.join(archive_dir, filename)))
+
+def prune(cache_dir, index, max_bytes):
+    """Evict least recently used .debs until the cache fits in max_bytes"""
+    total = sum(entry["size"] for entry in index.values())
+    evicted = 0
+    for filename, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(archives_dir(cache_dir), filename))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Still on disk, so it stays indexed and counted
+            continue
+        total -= entry["size"]
+        evicted += 1
+        del index[filename]
+    return evicted, total
+
+def update(cache_dir, planned, hits, max_mb):
+    """Index newly downloaded .debs, mark the used ones, prune and report"""
+    archive_dir = archives_dir(cache_dir)
+    index = load_index(cache_dir)
+    now = time.time()
+    present = {name for name in os.listdir(archive_dir) if name.endswith(".deb")}
+    for filename in list(index):
+        if filename not in present:
+            del index[filename]
+    for filename in present:
+        if filename not in index:
+            path = os.path.join(archive_dir, filename)
+            index[filename] = {"size": os.path.getsize(path), "sha256": sha256_file(path), "last_used": now}
+    for filename in planned:
+        if filename in index:
+            index[filename]["last_used"] = now
+    evicted, total = prune(cache_dir, index, max_mb * 1024 * 1024)
+    save_index(cache_dir, index)
+
+    rate = f"{hits / len(planned):.0%}" if planned else "n/a"
+    print(f"🗄️  apt cache: {hits}/{len(planned)} packages served from cache (hit rate {rate}), "
+          f"{len(index)} debs / {total / 1e6:.0f} MB stored"
+          + (f", {evicted} evicted" if evicted else ""))
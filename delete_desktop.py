@@ -1,36 +1,93 @@
 import os
-import subprocess
 import shutil
+import subprocess
+import time
 
-def run(cmd, check=True):
-    print(f"Running: {cmd}")
-    subprocess.run(cmd, shell=True, check=check)
+import cgroups
+import idle
+import proc_control
+import sessions
+import supervisor
+import volatile
 
-def kill_vnc():
-    print("Stopping VNC server...")
-    run("vncserver -kill :1", check=False)
+TERM_TIMEOUT = 5   # seconds to wait after SIGTERM before using SIGKILL
 
-def kill_websockify():
-    print("Killing websockify (noVNC)...")
-    run("pkill -f websockify", check=False)
+def all_sessions():
+    """The default desktop plus every session in the registry"""
+    registry = sessions.load_registry()
+    registry.setdefault(sessions.DEFAULT_NAME, sessions.default_session())
+    return [sessions.make_session(name, entry["display"]) for name, entry in registry.items()]
 
-def close_ports():
-    print("Closing ports 5901 and 6080...")
-    run("fuser -k 5901/tcp", check=False)
-    run("fuser -k 6080/tcp", check=False)
+def find_targets(desktops):
+    """{pid: description} of every Xvnc, proxy and port holder of the sessions, in one /proc scan"""
+    patterns = {}
+    for session in desktops:
+        patterns[proc_control.xvnc_pattern(session["display"])] = f"VNC server :{session['display']}"
+        patterns[proc_control.proxy_pattern(session["web_port"])] = f"websockify :{session['web_port']}"
+    targets = {}
+    for pid, argv in proc_control.iter_processes():
+        for pattern, description in patterns.items():
+            if proc_control.process_matches(argv, [pattern]):
+                targets[pid] = description
+                break
+    ports = [port for session in desktops for port in (session["vnc_port"], session["web_port"])]
+    for port, pids in proc_control.pids_on_ports(ports).items():
+        for pid in pids:
+            targets.setdefault(pid, f"listening on port {port}")
+    return targets
 
 def delete_configs():
     print("Removing VNC configuration files...")
     shutil.rmtree(os.path.expanduser("~/.vnc"), ignore_errors=True)
-    novnc_log = os.path.expanduser("~/.novnc.log")
-    if os.path.exists(novnc_log):
-        os.remove(novnc_log)
+    shutil.rmtree(sessions.SESSIONS_DIR, ignore_errors=True)
+    proc_control.remove_file(sessions.REGISTRY_PATH)
+    proc_control.remove_file(os.path.expanduser("~/.novnc.log"))
+    # The tmpfs of --tmpfs-mb only holds caches and logs, and keeps RAM until it's unmounted
+    if volatile.tmpfs_size() is not None:
+        subprocess.run(["sudo", "umount", volatile.MOUNT_POINT], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    shutil.rmtree(volatile.FALLBACK_DIR, ignore_errors=True)
 
 def main():
-    kill_vnc()
-    kill_websockify()
-    close_ports()
+    start = time.monotonic()
+    timings = []
+    desktops = all_sessions()
+    print(f"Stopping {len(desktops)} desktop(s): {', '.join(s['name'] for s in desktops)}")
+
+    # A running supervisor would restart the servers as soon as they are stopped
+    for session in desktops:
+        if supervisor.stop(session["supervisor_state"], TERM_TIMEOUT):
+            print(f"   ✅ Supervisor of '{session['name']}' stopped")
+    # Apps stopped by an idle freeze have to run again to act on SIGTERM (or X going away)
+    for session in desktops:
+        idle.thaw(session["name"])
+    targets = find_targets(desktops)
+    names = {pid: proc_control.process_name(pid) for pid in targets}
+    timings.append(("find processes", time.monotonic() - start))
+
+    # Every process gets SIGTERM at once and they shut down in parallel
+    step_start = time.monotonic()
+    exited, killed, survivors = proc_control.terminate(list(targets), TERM_TIMEOUT)
+    timings.append(("stop processes", time.monotonic() - step_start))
+    for pid in exited:
+        print(f"   ✅ {names[pid]} ({pid}, {targets[pid]}) stopped")
+    for pid in killed:
+        print(f"   💀 {names[pid]} ({pid}, {targets[pid]}) killed after {TERM_TIMEOUT}s")
+    for pid in survivors:
+        print(f"   ❌ {names[pid]} ({pid}, {targets[pid]}) is still running")
+
+    step_start = time.monotonic()
+    for session in desktops:
+        proc_control.remove_display_files(session["display"])
+        cgroups.remove(session["name"])
     delete_configs()
+    timings.append(("remove files", time.monotonic() - step_start))
+
+    print(f"\n⏱️  Teardown took {time.monotonic() - start:.2f}s ("
+          + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings) + ")")
+    print(f"   {len(exited)} processes stopped, {len(killed)} killed, {len(survivors)} survived")
+    if survivors:
+        print("Some processes could not be stopped (see above).")
+        exit(1)
     print("Desktop environment has been removed. All related services stopped and files deleted.")
 
 if __name__ == "__main__":
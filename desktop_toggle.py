@@ -1,10 +1,38 @@
 import os
+import glob
+import signal
 import subprocess
+import sys
 import time
 import shutil
+import hashlib
+import json
+import re
+import argparse
+import tempfile
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import apt_progress
+import cgroups
+import config_files
+import deb_cache
+import idle
+import log_rotation
+import metrics
+import proc_control
+import proc_stats
+import readiness
+import scheduler
+import sessions
+import supervisor
+import timing
+import volatile
+import xfconf
 
 def run(cmd, check=True, show_output=False):
     print(f"→ {cmd}")
+    timing.count_subprocess()
     if show_output:
         # Show output in real-time
         result = subprocess.run(cmd, shell=True, check=check)
@@ -14,187 +42,607 @@ def run(cmd, check=True, show_output=False):
         return result
 
 def run_install(cmd):
-    """Run installation command with visible output"""
+    """Run an installation command, showing a progress line instead of every line of output"""
     print(f"→ {cmd}")
-    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    while True:
-        line = process.stdout.readline()
-        if not line and process.poll() is not None:
-            break
-        if line:
-            print(line.rstrip())
-    return process.returncode
+    timing.count_subprocess()
+    os.makedirs(STATE_DIR, exist_ok=True)
+    log_rotation.rotate(INSTALL_LOG)
+    with open(INSTALL_LOG, "a") as log:
+        log.write(f"\n===== {time.strftime('%Y-%m-%d %H:%M:%S')} → {cmd}\n")
+    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL)
+    returncode = apt_progress.stream(process, INSTALL_LOG)
+    # Whatever it installed may have added executables to PATH
+    proc_control.invalidate_path_index()
+    return returncode
 
-def check_and_install_packages():
-    """Check if required packages are installed, install if missing"""
-    
-    # Core VNC packages
-    core_packages = [
-        "tigervnc-standalone-server", "tigervnc-common", "novnc", "websockify",
-        "xterm", "dbus-x11", "x11-xserver-utils"
-    ]
-    
-    # Desktop environment - XFCE
-    desktop_packages = [
-        "xfce4", "xfce4-terminal", "xfce4-goodies", "xfce4-taskmanager",
-        "thunar", "thunar-archive-plugin"
-    ]
-    
+# Core VNC packages
+core_packages = [
+    "tigervnc-standalone-server", "tigervnc-common", "novnc", "websockify",
+    "xterm", "dbus-x11", "x11-xserver-utils"
+]
+
+# Desktop environment - XFCE
+desktop_packages = [
+    "xfce4", "xfce4-terminal", "xfce4-goodies", "xfce4-taskmanager",
+    "thunar", "thunar-archive-plugin"
+]
+
+# Browsers
+browser_packages = [
+    "firefox-esr",       # Firefox browser
+    "chromium",          # Chromium browser
+]
+
+# File management & compression
+file_packages = [
+    "file-roller",       # Archive manager
+    "zip", "unzip", "p7zip-full", "rar", "unrar",
+    "tar", "gzip", "bzip2", "xz-utils"
+]
+
+# Office & productivity
+office_packages = [
+    "mousepad",          # Text editor
+    "libreoffice-writer", "libreoffice-calc", "libreoffice-impress",
+    "evince",            # PDF viewer
+    "galculator",        # Calculator
+    "gnome-calculator"
+]
+
+# Media & graphics
+media_packages = [
+    "ristretto",         # Image viewer
+    "gimp",              # Image editor
+    "inkscape",          # Vector graphics
+    "vlc",               # Media player
+    "audacious",         # Music player
+]
+
+# System utilities
+system_packages = [
+    "htop",              # System monitor
+    "gnome-system-monitor",
+    "gnome-disk-utility",
+    "gparted",           # Partition editor
+    "baobab",            # Disk usage analyzer
+    "xfce4-screenshooter",
+    "flameshot",         # Screenshot tool
+]
+
+# Development tools
+dev_packages = [
+    "geany",             # IDE/text editor
+    "meld",              # Diff/merge tool
+    "gitg",              # Git GUI
+    "git"
+]
+
+# Network & internet
+network_packages = [
+    "transmission-gtk",  # BitTorrent client
+    "filezilla",         # FTP client
+]
+
+# Wine for Windows apps
+wine_packages = [
+    "wine", "wine64", "winetricks"
+]
+
+# Themes and fonts
+theme_packages = [
+    "fonts-noto", "fonts-noto-color-emoji",
+    "fonts-dejavu", "fonts-liberation",
+    "adwaita-icon-theme", "papirus-icon-theme",
+    "arc-theme"
+]
+
+# Bluetooth support
+bluetooth_packages = [
+    "bluetooth", "bluez", "bluez-tools", "blueman"
+]
+
+# Extra useful packages
+extra_packages = [
+    "curl", "wget", "net-tools", "nano", "vim",
+    "python3", "python3-pip", "build-essential",
+    "software-properties-common", "apt-transport-https",
+    "ca-certificates", "gnupg", "lsb-release"
+]
+
+# Install packages in groups for better error handling
+package_groups = [
+    ("Core VNC", core_packages),
+    ("Desktop Environment", desktop_packages),
+    ("Browsers", browser_packages),
+    ("File Management", file_packages),
+    ("Office Suite", office_packages),
+    ("Media Apps", media_packages),
+    ("System Utilities", system_packages),
+    ("Development Tools", dev_packages),
+    ("Network Apps", network_packages),
+    ("Wine", wine_packages),
+    ("Themes & Fonts", theme_packages),
+    ("Bluetooth", bluetooth_packages),
+    ("Extra Tools", extra_packages),
+]
+
+# Named install profiles (group names from package_groups)
+INSTALL_PROFILES = {
+    "minimal": ["Core VNC", "Desktop Environment", "Browsers"],
+    "standard": ["Core VNC", "Desktop Environment", "Browsers", "File Management",
+                 "System Utilities", "Development Tools", "Themes & Fonts", "Extra Tools"],
+    "full": [name for name, _ in package_groups],
+}
+
+def get_profile_groups(profile):
+    """Return the (group_name, packages) pairs that make up an install profile"""
+    names = INSTALL_PROFILES[profile]
+    return [(name, packages) for name, packages in package_groups if name in names]
+
+def get_group(group_name):
+    for name, packages in package_groups:
+        if name == group_name:
+            return name, packages
+    raise Exception(f"Unknown package group: {group_name}")
+
+# Chromium and Firefox are started through generated wrappers tuned for Xvnc
+# (see create_browser_launchers)
+BIN_DIR = os.path.expanduser("~/.local/bin")
+CHROMIUM_LAUNCHER = os.path.join(BIN_DIR, "desktop-chromium")
+FIREFOX_LAUNCHER = os.path.join(BIN_DIR, "desktop-firefox")
+FIREFOX_PROFILE = os.path.expanduser("~/.mozilla/firefox/desktop-toggle")
+BROWSER_CACHE_MB = 64           # disk cache cap per browser
+BROWSER_RENDERER_LIMIT = 4      # renderer/content processes per browser
+BROWSER_HEAP_MB = 1024          # JavaScript heap cap per renderer
+
+# Every app we know about: the command(s) that show it is installed (check),
+# its package group, its desktop icon, and for the apps checked after
+# provisioning the name verify_installations() reports (verify). Entries
+# without exec get no desktop icon.
+APPS = [
+    # Core
+    {"name": "VNC Server", "exec": None, "check": "vncserver", "group": "Core VNC", "verify": "vncserver"},
     # Browsers
-    browser_packages = [
-        "firefox-esr",       # Firefox browser
-        "chromium",          # Chromium browser
-    ]
-    
-    # File management & compression
-    file_packages = [
-        "file-roller",       # Archive manager
-        "zip", "unzip", "p7zip-full", "rar", "unrar",
-        "tar", "gzip", "bzip2", "xz-utils"
-    ]
-    
-    # Office & productivity
-    office_packages = [
-        "mousepad",          # Text editor
-        "libreoffice-writer", "libreoffice-calc", "libreoffice-impress",
-        "evince",            # PDF viewer
-        "galculator",        # Calculator
-        "gnome-calculator"
-    ]
-    
-    # Media & graphics
-    media_packages = [
-        "ristretto",         # Image viewer
-        "gimp",              # Image editor
-        "inkscape",          # Vector graphics
-        "vlc",               # Media player
-        "audacious",         # Music player
-    ]
-    
-    # System utilities
-    system_packages = [
-        "htop",              # System monitor
-        "gnome-system-monitor",
-        "gnome-disk-utility",
-        "gparted",           # Partition editor
-        "baobab",            # Disk usage analyzer
-        "xfce4-screenshooter",
-        "flameshot",         # Screenshot tool
-    ]
-    
-    # Development tools
-    dev_packages = [
-        "geany",             # IDE/text editor
-        "meld",              # Diff/merge tool
-        "gitg",              # Git GUI
-        "git"
-    ]
-    
-    # Network & internet
-    network_packages = [
-        "transmission-gtk",  # BitTorrent client
-        "filezilla",         # FTP client
-    ]
-    
-    # Wine for Windows apps
-    wine_packages = [
-        "wine", "wine64", "winetricks"
-    ]
-    
-    # Themes and fonts
-    theme_packages = [
-        "fonts-noto", "fonts-noto-color-emoji",
-        "fonts-dejavu", "fonts-liberation",
-        "adwaita-icon-theme", "papirus-icon-theme",
-        "arc-theme"
-    ]
-    
-    # Bluetooth support
-    bluetooth_packages = [
-        "bluetooth", "bluez", "bluez-tools", "blueman"
+    {"name": "Firefox", "exec": FIREFOX_LAUNCHER, "check": "firefox-esr", "icon": "firefox-esr", "comment": "Web Browser", "group": "Browsers", "verify": "firefox-esr"},
+    {"name": "Chromium", "exec": CHROMIUM_LAUNCHER, "check": ["chromium", "chromium-browser"], "icon": "chromium", "comment": "Chromium Web Browser", "group": "Browsers", "verify": "chromium"},
+    # File Management
+    {"name": "Files", "exec": "thunar", "check": "thunar", "icon": "system-file-manager", "comment": "File Manager", "group": "Desktop Environment"},
+    {"name": "Archive Manager", "exec": "file-roller", "check": "file-roller", "icon": "org.gnome.FileRoller", "comment": "Create and extract archives", "group": "File Management"},
+    # Office
+    {"name": "LibreOffice Writer", "exec": "libreoffice --writer", "check": "libreoffice", "icon": "libreoffice-writer", "comment": "Word Processor", "group": "Office Suite", "verify": "libreoffice"},
+    {"name": "LibreOffice Calc", "exec": "libreoffice --calc", "check": "libreoffice", "icon": "libreoffice-calc", "comment": "Spreadsheet", "group": "Office Suite"},
+    {"name": "LibreOffice Impress", "exec": "libreoffice --impress", "check": "libreoffice", "icon": "libreoffice-impress", "comment": "Presentations", "group": "Office Suite"},
+    {"name": "PDF Viewer", "exec": "evince", "check": "evince", "icon": "org.gnome.Evince", "comment": "View PDF documents", "group": "Office Suite"},
+    {"name": "Calculator", "exec": "galculator", "check": "galculator", "icon": "galculator", "comment": "Calculator", "group": "Office Suite"},
+    # Text Editors
+    {"name": "Mousepad", "exec": "mousepad", "check": "mousepad", "icon": "mousepad", "comment": "Simple Text Editor", "group": "Office Suite"},
+    {"name": "Geany", "exec": "geany", "check": "geany", "icon": "geany", "comment": "IDE and Text Editor", "group": "Development Tools"},
+    # Media
+    {"name": "Image Viewer", "exec": "ristretto", "check": "ristretto", "icon": "ristretto", "comment": "View Images", "group": "Media Apps"},
+    {"name": "GIMP", "exec": "gimp", "check": "gimp", "icon": "gimp", "comment": "Image Editor", "group": "Media Apps", "verify": "gimp"},
+    {"name": "Inkscape", "exec": "inkscape", "check": "inkscape", "icon": "inkscape", "comment": "Vector Graphics Editor", "group": "Media Apps"},
+    {"name": "VLC Media Player", "exec": "vlc", "check": "vlc", "icon": "vlc", "comment": "Play Videos and Music", "group": "Media Apps", "verify": "vlc"},
+    {"name": "Audacious", "exec": "audacious", "check": "audacious", "icon": "audacious", "comment": "Music Player", "group": "Media Apps"},
+    # System Tools
+    {"name": "Terminal", "exec": "xfce4-terminal", "check": "xfce4-terminal", "icon": "utilities-terminal", "comment": "Terminal Emulator", "group": "Desktop Environment"},
+    {"name": "Task Manager", "exec": "xfce4-taskmanager", "check": "xfce4-taskmanager", "icon": "utilities-system-monitor", "comment": "Monitor System Resources", "group": "Desktop Environment"},
+    {"name": "System Monitor", "exec": "gnome-system-monitor", "check": "gnome-system-monitor", "icon": "utilities-system-monitor", "comment": "View System Resources", "group": "System Utilities"},
+    {"name": "Disk Usage", "exec": "baobab", "check": "baobab", "icon": "baobab", "comment": "Analyze Disk Usage", "group": "System Utilities"},
+    {"name": "Disks", "exec": "gnome-disks", "check": "gnome-disks", "icon": "gnome-disks", "comment": "Disk Management", "group": "System Utilities"},
+    {"name": "GParted", "exec": "gparted", "check": "gparted", "icon": "gparted", "comment": "Partition Editor", "group": "System Utilities"},
+    {"name": "Screenshot", "exec": "xfce4-screenshooter", "check": "xfce4-screenshooter", "icon": "applets-screenshooter", "comment": "Take Screenshots", "group": "System Utilities"},
+    {"name": "Flameshot", "exec": "flameshot gui", "check": "flameshot", "icon": "flameshot", "comment": "Advanced Screenshot Tool", "group": "System Utilities"},
+    # Development
+    {"name": "Meld", "exec": "meld", "check": "meld", "icon": "meld", "comment": "Diff and Merge Tool", "group": "Development Tools"},
+    {"name": "Gitg", "exec": "gitg", "check": "gitg", "icon": "gitg", "comment": "Git Repository Viewer", "group": "Development Tools"},
+    # Network
+    {"name": "Transmission", "exec": "transmission-gtk", "check": "transmission-gtk", "icon": "transmission", "comment": "BitTorrent Client", "group": "Network Apps"},
+    {"name": "FileZilla", "exec": "filezilla", "check": "filezilla", "icon": "filezilla", "comment": "FTP Client", "group": "Network Apps", "verify": "filezilla"},
+    # Wine
+    {"name": "Wine Configuration", "exec": "winecfg", "check": "winecfg", "icon": "wine", "comment": "Configure Wine", "group": "Wine"},
+    {"name": "Wine File Manager", "exec": "wine explorer", "check": "wine", "icon": "wine", "comment": "Wine File Explorer", "group": "Wine", "verify": "wine"},
+    # Bluetooth
+    {"name": "Bluetooth Manager", "exec": "blueman-manager", "check": "blueman-manager", "icon": "bluetooth", "comment": "Manage Bluetooth Devices", "group": "Bluetooth"},
+]
+
+def app_installed(app):
+    checks = app["check"] if isinstance(app["check"], list) else [app["check"]]
+    return any(proc_control.which(cmd) for cmd in checks)
+
+DPKG_STATUS = os.environ.get("DESKTOP_DPKG_STATUS", "/var/lib/dpkg/status")
+STATE_DIR = os.path.expanduser("~/.desktop_toggle")
+MANIFEST_PATH = os.path.join(STATE_DIR, "provisioned.json")
+INSTALL_LOG = os.path.join(STATE_DIR, "install.log")
+
+def get_installed_packages():
+    """Read the set of installed package names straight from the dpkg status file"""
+    installed = set()
+    if not os.path.exists(DPKG_STATUS):
+        return installed
+    name = None
+    with open(DPKG_STATUS, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("Package:"):
+                name = line.split(":", 1)[1].strip()
+            elif line.startswith("Status:") and name:
+                # e.g. "Status: install ok installed" vs "deinstall ok config-files"
+                if line.split()[-1] == "installed":
+                    installed.add(name)
+    return installed
+
+def packages_hash(groups):
+    """Hash of the requested package list, used to invalidate the manifest"""
+    names = sorted(pkg for _, packages in groups for pkg in packages)
+    return hashlib.sha256("\n".join(names).encode()).hexdigest()
+
+def dpkg_status_mtime():
+    try:
+        return os.stat(DPKG_STATUS).st_mtime
+    except OSError:
+        return None
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(groups, missing):
+    """Remember what was provisioned so the next start can skip dpkg/apt entirely"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    manifest = {
+        "packages_hash": packages_hash(groups),
+        "dpkg_status_mtime": dpkg_status_mtime(),
+        "missing": missing,
+        "updated": time.time(),
+    }
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def manifest_is_current(groups):
+    """True if nothing changed in dpkg since the last provisioning run"""
+    manifest = load_manifest()
+    if not manifest:
+        return False
+    return (manifest.get("packages_hash") == packages_hash(groups)
+            and manifest.get("dpkg_status_mtime") == dpkg_status_mtime())
+
+def find_missing_packages(groups):
+    """Return [(group_name, [missing packages])] for groups with anything missing"""
+    installed = get_installed_packages()
+    missing_groups = []
+    for group_name, packages in groups:
+        missing = [pkg for pkg in packages if pkg not in installed]
+        if missing:
+            missing_groups.append((group_name, missing))
+    return missing_groups
+
+APT_ARCHIVES = "/var/cache/apt/archives"
+DOWNLOAD_WORKERS = 8
+APT_ETC = "/etc/apt"
+DEFAULT_APT_CACHE_MB = 4096
+
+def get_install_candidates(packages):
+    """Return the subset of packages apt has an install candidate for (one apt-cache call)"""
+    timing.count_subprocess()
+    result = subprocess.run(["apt-cache", "policy"] + list(packages),
+                            capture_output=True, text=True)
+    available = set()
+    current = None
+    for line in result.stdout.splitlines():
+        if line and not line.startswith(" ") and line.endswith(":"):
+            current = line[:-1]
+        elif current and line.strip().startswith("Candidate:"):
+            if line.split(":", 1)[1].strip() != "(none)":
+                available.add(current)
+    return available
+
+def plan_downloads(packages, apt_opts=""):
+    """Resolve the whole transaction once and list the .debs apt still has to fetch.
+
+    Returns [(url, filename, size, checksum)]; debs already in the archive dir
+    (apt's own cache, or the --apt-cache dir) are not listed.
+    """
+    result = run(f"sudo apt-get install -y -qq --print-uris {apt_opts} {' '.join(packages)}", check=False)
+    downloads = []
+    for line in result.stdout.splitlines():
+        if not line.startswith("'"):
+            continue
+        fields = line.split()
+        url, filename, size = fields[0].strip("'"), fields[1], int(fields[2])
+        checksum = fields[3] if len(fields) > 3 else ""
+        downloads.append((url, filename, size, checksum))
+    return downloads
+
+def apt_has_proxy_or_auth():
+    """True if apt is set up with a proxy or credentials our own downloader wouldn't use"""
+    auth_files = [os.path.join(APT_ETC, "auth.conf")] + glob.glob(os.path.join(APT_ETC, "auth.conf.d", "*"))
+    for path in auth_files:
+        try:
+            if os.path.getsize(path) > 0:
+                return True
+        except OSError:
+            pass
+    conf_files = [os.path.join(APT_ETC, "apt.conf")] + glob.glob(os.path.join(APT_ETC, "apt.conf.d", "*"))
+    if os.environ.get("APT_CONFIG"):
+        conf_files.append(os.environ["APT_CONFIG"])
+    for path in conf_files:
+        try:
+            with open(path, errors="replace") as f:
+                text = re.sub(r"/\*.*?\*/", "", f.read(), flags=re.S)
+        except OSError:
+            continue
+        for line in text.splitlines():
+            # Acquire::http::Proxy, Acquire { https { Proxy ...; }; }, Proxy-Auto-Detect
+            if re.search(r"\bProxy", line.split("//", 1)[0].split("#", 1)[0], re.I):
+                return True
+    return False
+
+def download_deb(url, filename, size, checksum, staging_dir):
+    """Fetch one .deb and verify it against the checksum apt gave us"""
+    path = os.path.join(staging_dir, filename)
+    algorithm, _, expected = checksum.partition(":")
+    algorithm = {"MD5Sum": "md5", "SHA1": "sha1", "SHA256": "sha256", "SHA512": "sha512"}.get(algorithm)
+    digest = hashlib.new(algorithm) if algorithm and expected else None
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response, open(path + ".partial", "wb") as f:
+            while True:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if digest:
+                    digest.update(chunk)
+        if digest and digest.hexdigest() != expected:
+            raise Exception("checksum mismatch")
+        os.replace(path + ".partial", path)
+        return filename, size, None
+    except Exception as e:
+        proc_control.remove_file(path + ".partial")
+        return filename, 0, str(e)
+
+def download_debs(downloads, archive_dir):
+    """Download .debs concurrently into a staging dir, then move them into apt's archive dir"""
+    staging_dir = tempfile.mkdtemp(prefix="desktop_toggle_debs_")
+    total_bytes = sum(size for _, _, size, _ in downloads)
+    print(f"⬇️  Downloading {len(downloads)} packages ({total_bytes / 1e6:.0f} MB, {DOWNLOAD_WORKERS} parallel downloads)")
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            futures = [pool.submit(download_deb, url, filename, size, checksum, staging_dir)
+                       for url, filename, size, checksum in downloads]
+            for future in as_completed(futures):
+                filename, size, error = future.result()
+                if error:
+                    failed.append(filename)
+                    print(f"   ⚠️  {filename}: {error}")
+                timing.add_downloaded_bytes(size)
+        # apt will fetch anything that failed here itself during the install
+        if len(failed) < len(downloads):
+            run(f"sudo find {staging_dir} -name '*.deb' -exec mv -f -t {archive_dir} {{}} +", check=False)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    print(f"   ✅ {len(downloads) - len(failed)} downloaded, {len(failed)} left for apt to retry")
+
+def install_package_groups(missing_groups, apt_cache=None, apt_cache_mb=DEFAULT_APT_CACHE_MB):
+    """Install all missing groups in one apt transaction.
+
+    Unavailable packages are filtered out up front, the transaction is resolved
+    once, the .debs are downloaded concurrently, and a single apt-get install
+    then unpacks everything so dependency resolution and dpkg triggers only run
+    once. Anything still missing afterwards is reported against its group name.
+    With apt_cache set, .debs are kept in that directory across rebuilds.
+    """
+    all_missing = [pkg for _, packages in missing_groups for pkg in packages]
+    with timing.phase("apt: check candidates", "apt"):
+        available = get_install_candidates(all_missing)
+    install_groups = []
+    for group_name, packages in missing_groups:
+        unavailable = [pkg for pkg in packages if pkg not in available]
+        if unavailable:
+            print(f"⚠️  {group_name}: no install candidate for {', '.join(unavailable)}, skipping")
+        packages = [pkg for pkg in packages if pkg in available]
+        if packages:
+            install_groups.append((group_name, packages))
+    if not install_groups:
+        return
+
+    packages = [pkg for _, group_packages in install_groups for pkg in group_packages]
+    apt_opts = ""
+    archive_dir = APT_ARCHIVES
+    if apt_cache:
+        deb_cache.prepare(apt_cache)
+        apt_opts = deb_cache.apt_options(apt_cache)
+        archive_dir = deb_cache.archives_dir(apt_cache)
+        with timing.phase("apt: simulate", "apt"):
+            planned = deb_cache.planned_debs(run(f"sudo apt-get install -s -qq {apt_opts} {' '.join(packages)}",
+                                                 check=False).stdout)
+        cache_hits = deb_cache.count_hits(apt_cache, planned)
+
+    print("\n" + "="*60)
+    print(f"⬇️  DOWNLOADING: {len(install_groups)} groups")
+    print("="*60)
+    with timing.phase("apt: download", "apt"):
+        downloads = plan_downloads(packages, apt_opts)
+        if downloads and apt_has_proxy_or_auth():
+            print("   apt has a proxy or credentials configured, letting apt download the packages")
+            run_install(f"sudo apt-get install -y --download-only {apt_opts} {' '.join(packages)}")
+        elif downloads:
+            download_debs(downloads, archive_dir)
+        else:
+            print("   ✅ Nothing to download")
+
+    packages = [pkg for _, group_packages in install_groups for pkg in group_packages]
+    print("\n" + "="*60)
+    print(f"📦 INSTALLING: {len(packages)} packages in one transaction")
+    print("="*60)
+    with timing.phase("apt: install", "apt"):
+        ret = run_install(f"sudo DEBIAN_FRONTEND=noninteractive apt-get install -y --fix-missing {apt_opts} {' '.join(packages)}")
+    if ret != 0:
+        # Fall back to per-group installs so one bad group can't block the others
+        print("⚠️  Combined install failed, retrying group by group...")
+        for group_name, group_packages in find_missing_packages(install_groups):
+            print("\n" + "="*60)
+            print(f"📦 INSTALLING: {group_name} ({len(group_packages)} packages)")
+            print("="*60)
+            with timing.phase(f"apt: install {group_name}", "apt"):
+                run_install(f"sudo DEBIAN_FRONTEND=noninteractive apt-get install -y --fix-missing {apt_opts} {' '.join(group_packages)}")
+
+    for group_name, group_packages in find_missing_packages(install_groups):
+        print(f"⚠️  Some {group_name} packages may have failed: {', '.join(group_packages)}")
+
+    if apt_cache:
+        deb_cache.update(apt_cache, planned, cache_hits, apt_cache_mb)
+
+# Image layers, most stable first, so that a change to a frequently updated
+# group (browsers get security releases constantly) only rebuilds the layers after it
+IMAGE_LAYER_ORDER = [
+    "Extra Tools", "Core VNC", "Desktop Environment", "Themes & Fonts", "File Management",
+    "System Utilities", "Development Tools", "Bluetooth", "Office Suite", "Media Apps",
+    "Network Apps", "Wine", "Browsers",
+]
+IMAGE_BASE = "mcr.microsoft.com/devcontainers/base:debian"
+PREBAKED_MARKER = "/etc/desktop-toggle/prebaked.json"
+DOCKERFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".devcontainer", "DockerFile")
+
+def image_is_prebaked(groups):
+    """True if this is an image from build-image that contains every requested package"""
+    try:
+        with open(PREBAKED_MARKER) as f:
+            prebaked = set(json.load(f)["packages"])
+    except (OSError, ValueError, KeyError):
+        return False
+    return all(pkg in prebaked for _, packages in groups for pkg in packages)
+
+def generate_dockerfile(profile="full"):
+    """Render a Dockerfile with one cached apt layer per package group"""
+    groups = dict(get_profile_groups(profile))
+    # Groups missing from IMAGE_LAYER_ORDER still get a layer, after the others
+    layers = ([name for name in IMAGE_LAYER_ORDER if name in groups]
+              + [name for name in groups if name not in IMAGE_LAYER_ORDER])
+    # The marker only claims what the layers below really install
+    packages = sorted(pkg for name in layers for pkg in groups[name])
+    marker = json.dumps({"profile": profile, "packages": packages})
+    lines = [
+        "# syntax=docker/dockerfile:1",
+        f"# Generated by `python3 desktop_toggle.py build-image --profile {profile}`.",
+        "# Edit package_groups in desktop_toggle.py and regenerate instead of editing this file.",
+        f"FROM {IMAGE_BASE}",
+        "",
+        "ARG DEBIAN_FRONTEND=noninteractive",
+        "",
+        "# Keep downloaded .debs in the BuildKit cache between builds and enable",
+        "# contrib/non-free for rar/unrar",
+        "RUN rm -f /etc/apt/apt.conf.d/docker-clean \\",
+        "    && sed -i 's/^Components: main$/Components: main contrib non-free/' /etc/apt/sources.list.d/debian.sources",
     ]
-    
-    # Extra useful packages
-    extra_packages = [
-        "curl", "wget", "net-tools", "nano", "vim",
-        "python3", "python3-pip", "build-essential",
-        "software-properties-common", "apt-transport-https",
-        "ca-certificates", "gnupg", "lsb-release"
+    for group_name in layers:
+        lines += [
+            "",
+            f"# {group_name}",
+            "RUN --mount=type=cache,target=/var/cache/apt,sharing=locked \\",
+            "    --mount=type=cache,target=/var/lib/apt/lists,sharing=locked \\",
+            "    apt-get update && apt-get install -y \\",
+            "    " + " ".join(groups[group_name]),
+        ]
+    lines += [
+        "",
+        "# Lets desktop_toggle.py skip package provisioning in this image",
+        f"RUN mkdir -p {os.path.dirname(PREBAKED_MARKER)} && echo '{marker}' > {PREBAKED_MARKER}",
+        "",
     ]
-    
-    print("🔍 Checking and installing packages...")
-    
-    all_packages = (core_packages + desktop_packages + browser_packages + 
-                   file_packages + office_packages + media_packages + 
-                   system_packages + dev_packages + network_packages + 
-                   wine_packages + theme_packages + bluetooth_packages + extra_packages)
-    
+    return "\n".join(lines)
+
+def build_image(profile="full", output=DOCKERFILE_PATH):
+    print(f"🐳 Writing Dockerfile for the '{profile}' profile to {output}")
+    with open(output, "w") as f:
+        f.write(generate_dockerfile(profile))
+    print("✅ Done. Rebuild the dev container (or run `docker build -f <Dockerfile> .`) to use it")
+
+def check_and_install_packages(profile="full", apt_cache=None, apt_cache_mb=DEFAULT_APT_CACHE_MB):
+    """Check if required packages are installed, install if missing"""
+    print(f"🔍 Checking and installing packages (profile: {profile})...")
+    groups = get_profile_groups(profile)
+
+    # Container image built with build-image already has everything
+    if image_is_prebaked(groups):
+        print(f"📦 Prebaked image detected ({PREBAKED_MARKER}), skipping provisioning")
+        return
+
+    # Warm start: dpkg hasn't changed since we last provisioned
+    if manifest_is_current(groups):
+        print("⚡ Packages already provisioned (dpkg unchanged since last run), skipping apt")
+        print(f"💡 Delete {MANIFEST_PATH} to force a full package check")
+        verify_installations(groups)
+        return
+
+    missing_groups = find_missing_packages(groups)
+    if not missing_groups:
+        print("⚡ All packages already installed, skipping apt")
+        save_manifest(groups, [])
+        verify_installations(groups)
+        return
+
+    missing_count = sum(len(packages) for _, packages in missing_groups)
+    print(f"📋 {missing_count} packages missing in {len(missing_groups)} groups")
+
     # Update package list first
     print("\n" + "="*60)
     print("📦 UPDATING PACKAGE LISTS...")
     print("="*60)
-    run_install("sudo apt-get update -y")
+    with timing.phase("apt: update", "apt"):
+        run_install("sudo apt-get update -y")
     
     # Fix any broken packages first
     print("\n" + "="*60)
     print("🔧 FIXING ANY BROKEN PACKAGES...")
     print("="*60)
-    run_install("sudo dpkg --configure -a")
-    run_install("sudo apt-get install -f -y")
+    with timing.phase("apt: fix broken", "apt"):
+        run_install("sudo dpkg --configure -a")
+        run_install("sudo apt-get install -f -y")
     
-    # Install packages in groups for better error handling
-    package_groups = [
-        ("Core VNC", core_packages),
-        ("Desktop Environment", desktop_packages),
-        ("Browsers", browser_packages),
-        ("File Management", file_packages),
-        ("Office Suite", office_packages),
-        ("Media Apps", media_packages),
-        ("System Utilities", system_packages),
-        ("Development Tools", dev_packages),
-        ("Network Apps", network_packages),
-        ("Wine", wine_packages),
-        ("Themes & Fonts", theme_packages),
-        ("Bluetooth", bluetooth_packages),
-        ("Extra Tools", extra_packages),
-    ]
-    
-    for group_name, packages in package_groups:
-        print("\n" + "="*60)
-        print(f"📦 INSTALLING: {group_name} ({len(packages)} packages)")
-        print("="*60)
-        install_cmd = f"sudo DEBIAN_FRONTEND=noninteractive apt-get install -y --fix-missing {' '.join(packages)}"
-        ret = run_install(install_cmd)
-        if ret != 0:
-            print(f"⚠️  Some {group_name} packages may have failed, continuing...")
+    install_package_groups(missing_groups, apt_cache, apt_cache_mb)
     
     # Final fix attempt
     print("\n" + "="*60)
     print("🔧 FINAL CLEANUP...")
     print("="*60)
-    run_install("sudo apt-get install -f -y")
-    
-    # Verify critical apps and their actual executables
-    critical_checks = {
-        "vncserver": "vncserver",
-        "firefox-esr": "firefox-esr",
-        "chromium": ["chromium", "chromium-browser"],
-        "gimp": "gimp",
-        "vlc": "vlc",
-        "wine": "wine",
-        "filezilla": "filezilla",
-        "libreoffice": "libreoffice"
-    }
+    with timing.phase("apt: final cleanup", "apt"):
+        run_install("sudo apt-get install -f -y")
+
+    # Packages that are still missing (e.g. not available in this distro) are
+    # recorded so the next start doesn't retry them unless dpkg changes
+    still_missing = [pkg for _, packages in find_missing_packages(groups) for pkg in packages]
+    save_manifest(groups, still_missing)
+    verify_installations(groups)
+
+def install_group(group_name):
+    """Install a single package group on demand (used by the lazy launchers)"""
+    groups = [get_group(group_name)]
+    missing_groups = find_missing_packages(groups)
+    if not missing_groups:
+        print(f"✅ {group_name} is already installed")
+        return
+    print(f"📦 Installing {group_name} on first use...")
+    run_install("sudo apt-get update -y")
+    install_package_groups(missing_groups, os.environ.get("DESKTOP_APT_CACHE"))
+    verify_installations(groups)
+
+def verify_installations(groups=package_groups):
+    """Verify critical apps and their actual executables"""
+    group_names = [name for name, _ in groups]
     
     print("\n🔎 Verifying installations...")
     missing = []
-    for name, executable in critical_checks.items():
-        if isinstance(executable, list):
-            found = any(shutil.which(exe) for exe in executable)
-        else:
-            found = shutil.which(executable) is not None
-        
-        if not found:
+    for app in APPS:
+        if "verify" not in app or app["group"] not in group_names:
+            continue
+        name = app["verify"]
+        if not app_installed(app):
             missing.append(name)
             print(f"   ❌ {name} - NOT FOUND")
         else:
@@ -206,23 +654,46 @@ def check_and_install_packages():
     else:
         print("\n✅ All critical packages installed successfully!")
 
-def kill_existing():
+def kill_existing(session=None):
+    session = session or sessions.default_session()
     print("🔻 Killing existing VNC and noVNC processes...")
-    run("vncserver -kill :1 2>/dev/null", check=False)
-    run("pkill -f Xvnc", check=False)
-    run("pkill -f Xtightvnc", check=False)
-    run("pkill -f websockify", check=False)
+    # Before the servers, or the supervisor would start them right up again
+    if supervisor.stop(session["supervisor_state"]):
+        print("   Stopped the session's supervisor")
+    if idle.thaw(session["name"]):
+        print("   Resumed the apps an idle freeze had stopped")
+    pids = proc_control.find_pids([proc_control.xvnc_pattern(session["display"]),
+                                   proc_control.proxy_pattern(session["web_port"])])
+    exited, killed, survivors = proc_control.terminate(pids)
+    if exited or killed:
+        print(f"   Stopped {len(exited) + len(killed)} processes"
+              + (f" ({len(killed)} needed SIGKILL)" if killed else ""))
+    if survivors:
+        print(f"⚠️  Could not stop pids {', '.join(map(str, survivors))}")
 
     print("🧹 Removing stale lock files...")
-    run("rm -f /tmp/.X1-lock", check=False)
-    run("rm -f /tmp/.X11-unix/X1", check=False)
+    proc_control.remove_display_files(session["display"])
 
-def setup_vnc_password(password="user123"):
-    passwd_file = os.path.expanduser("~/.vnc/passwd")
+def setup_vnc_password(password="user123", session=None):
+    session = session or sessions.default_session()
+    passwd_file = os.path.join(session["state_dir"], "passwd")
+    # Hash of the password and of the passwd file it produced, so vncpasswd only
+    # has to run again when either of them changed
+    hash_file = passwd_file + ".sha256"
     print("🔐 Setting VNC password...")
-    os.makedirs(os.path.expanduser("~/.vnc"), exist_ok=True)
-    
+    os.makedirs(session["state_dir"], exist_ok=True)
+
+    expected = f"{config_files.content_hash(password)} {config_files.file_hash(passwd_file)}\n"
+    try:
+        with open(hash_file) as f:
+            if f.read() == expected:
+                print("   ✅ Password unchanged")
+                return
+    except OSError:
+        pass
+
     # Use vncpasswd with password input
+    timing.count_subprocess()
     proc = subprocess.Popen(
         ["vncpasswd", "-f"], 
         stdin=subprocess.PIPE, 
@@ -231,88 +702,168 @@ def setup_vnc_password(password="user123"):
     )
     stdout, _ = proc.communicate(input=f"{password}\n{password}\n".encode())
     
-    with open(passwd_file, "wb") as f:
-        f.write(stdout)
-    os.chmod(passwd_file, 0o600)
+    config_files.write_if_changed(passwd_file, stdout, 0o600)
+    config_files.write_if_changed(hash_file, f"{config_files.content_hash(password)} {config_files.content_hash(stdout)}\n", 0o600)
+
+# Common laptop screen sizes, added to Xvnc's own list so they can also be
+# picked in XFCE's Display settings. Any other size a viewer asks for (the
+# browser window with resize=remote) is created by Xvnc on the fly.
+EXTRA_SCREEN_MODES = ["1280x800", "1366x768", "1440x900", "1536x864", "1680x1050", "1920x1200", "2560x1440"]
 
-def create_xstartup():
+def create_xstartup(session=None, apps_cgroup=None, cache_home=None):
+    session = session or sessions.default_session()
     print("📝 Creating VNC startup script...")
-    xstartup_path = os.path.expanduser("~/.vnc/xstartup")
-    with open(xstartup_path, "w") as f:
-        f.write("#!/bin/bash\n\n")
-        f.write("# Prevent session manager issues\n")
-        f.write("unset SESSION_MANAGER\n")
-        f.write("unset DBUS_SESSION_BUS_ADDRESS\n\n")
-        f.write("# Set up environment\n")
-        f.write("export XDG_SESSION_TYPE=x11\n")
-        f.write("export XDG_CURRENT_DESKTOP=XFCE\n")
-        f.write("export XDG_SESSION_DESKTOP=xfce\n")
-        f.write("export DISPLAY=:1\n\n")
-        f.write("# Start D-Bus for the session\n")
-        f.write("if [ -z \"$DBUS_SESSION_BUS_ADDRESS\" ]; then\n")
-        f.write("    eval $(dbus-launch --sh-syntax)\n")
-        f.write("    export DBUS_SESSION_BUS_ADDRESS\n")
-        f.write("fi\n\n")
-        f.write("# Disable screen blanking\n")
-        f.write("xset s off\n")
-        f.write("xset s noblank\n")
-        f.write("xset -dpms\n\n")
-        f.write("# Kill any screensaver processes\n")
-        f.write("pkill -9 xfce4-screensaver 2>/dev/null\n")
-        f.write("pkill -9 light-locker 2>/dev/null\n")
-        f.write("pkill -9 xscreensaver 2>/dev/null\n\n")
-        f.write("# Start XFCE4 desktop\n")
-        f.write("startxfce4 &\n")
-        f.write("\n# Keep the session alive\n")
-        f.write("wait\n")
-    os.chmod(xstartup_path, 0o755)
-
-def create_vnc_config():
-    print("⚙️  Creating VNC configuration...")
-    vnc_dir = os.path.expanduser("~/.vnc")
-    config_path = os.path.join(vnc_dir, "config")
-    
-    with open(config_path, "w") as f:
-        f.write("# TigerVNC Configuration\n")
-        f.write("geometry=1920x1080\n")
-        f.write("depth=24\n")
-        f.write("localhost=no\n")
-        f.write("alwaysshared=yes\n")
-        f.write("desktop=XFCE Desktop\n")
-    
-    os.chmod(config_path, 0o644)
+    xstartup_path = os.path.join(session["state_dir"], "xstartup")
+    content = "#!/bin/bash\n\n"
+    if apps_cgroup:
+        content += (
+            "# Run the desktop and every app started from it in the session's apps cgroup\n"
+            f"echo $$ > {apps_cgroup}/cgroup.procs 2>/dev/null\n\n"
+        )
+    content += (
+        "# Prevent session manager issues\n"
+        "unset SESSION_MANAGER\n"
+        "unset DBUS_SESSION_BUS_ADDRESS\n\n"
+        "# Set up environment\n"
+        "export XDG_SESSION_TYPE=x11\n"
+        "export XDG_CURRENT_DESKTOP=XFCE\n"
+        "export XDG_SESSION_DESKTOP=xfce\n"
+        f"export DISPLAY=:{session['display']}\n"
+        + (f"export XDG_CACHE_HOME={cache_home}\n" if cache_home else "")
+        + "\n"
+        "# Start D-Bus for the session\n"
+        "if [ -z \"$DBUS_SESSION_BUS_ADDRESS\" ]; then\n"
+        "    eval $(dbus-launch --sh-syntax)\n"
+        "    export DBUS_SESSION_BUS_ADDRESS\n"
+        "fi\n\n"
+        "# Disable screen blanking\n"
+        "xset s off\n"
+        "xset s noblank\n"
+        "xset -dpms\n\n"
+        "# Kill any screensaver processes\n"
+        "pkill -9 xfce4-screensaver 2>/dev/null\n"
+        "pkill -9 light-locker 2>/dev/null\n"
+        "pkill -9 xscreensaver 2>/dev/null\n\n"
+        "# Register extra screen sizes in the background (Xvnc ignores the timings)\n"
+        f"for mode in {' '.join(EXTRA_SCREEN_MODES)}; do\n"
+        "    xrandr --newmode \"$mode\" 0 ${mode%x*} 0 0 0 ${mode#*x} 0 0 0 2>/dev/null\n"
+        "    xrandr --addmode VNC-0 \"$mode\" 2>/dev/null\n"
+        "done &\n\n"
+        "# Start XFCE4 desktop\n"
+        "startxfce4 &\n"
+        "\n# Keep the session alive\n"
+        "wait\n"
+    )
+    config_files.write_if_changed(xstartup_path, content, 0o755)
+
+# Performance presets. Geometry, depth, FrameRate, CompareFB and ZlibLevel are
+# TigerVNC server settings; quality/compression are noVNC client settings
+# (JPEG quality and zlib level for the Tight encoding) passed in the URL.
+# The geometry is only the starting size: noVNC asks the server to resize the
+# screen to the browser window (resize=remote, sent once resizing stops) and
+# Xvnc follows, so a small viewport gets a small framebuffer to encode.
+VNC_PRESETS = {
+    "lan": {"geometry": "1920x1080", "depth": 24, "FrameRate": 60, "CompareFB": 2, "ZlibLevel": 1,
+            "quality": 9, "compression": 0},
+    "wan": {"geometry": "1600x900", "depth": 24, "FrameRate": 30, "CompareFB": 1, "ZlibLevel": 6,
+            "quality": 6, "compression": 2},
+    "low-bandwidth": {"geometry": "1280x720", "depth": 16, "FrameRate": 15, "CompareFB": 1, "ZlibLevel": 9,
+                      "quality": 3, "compression": 9},
+}
+SERVER_PRESET_KEYS = ["FrameRate", "CompareFB", "ZlibLevel"]
+
+def measured_rtt():
+    """Last WebSocket round-trip time seen by the built-in proxy, in ms (or None)"""
+    try:
+        with open(PROXY_STATS) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return None
+    rtts = [c["rtt_ms"] for c in stats.get("connections", []) if c.get("rtt_ms") is not None]
+    if rtts:
+        return sorted(rtts)[len(rtts) // 2]
+    return stats.get("totals", {}).get("last_rtt_ms")
+
+def resolve_preset(preset):
+    """Turn "auto" into a concrete preset using the RTT the built-in proxy measured"""
+    if preset != "auto":
+        return preset
+    rtt = measured_rtt()
+    if rtt is None:
+        # Nothing measured yet: Codespaces is always reached over a port forward
+        chosen = "wan" if os.environ.get("CODESPACES") else "lan"
+        print(f"📶 No RTT measured yet, using the '{chosen}' preset")
+    else:
+        chosen = "lan" if rtt < 15 else "wan" if rtt < 80 else "low-bandwidth"
+        print(f"📶 Measured {rtt:.0f} ms round trip to the browser, using the '{chosen}' preset")
+    return chosen
+
+# Settings vncserver takes itself, as "-name value"; everything else goes to
+# Xvnc as "-Name=value" (the only form Xvnc accepts for booleans)
+VNCSERVER_OPTIONS = ["geometry", "depth", "localhost", "desktop"]
+
+def vnc_settings(preset="lan"):
+    """Every server setting of a preset, in config file order"""
+    settings = VNC_PRESETS[preset]
+    return ([("geometry", settings["geometry"]), ("depth", settings["depth"])]
+            + [(key, settings[key]) for key in SERVER_PRESET_KEYS]
+            + [("localhost", "no"), ("alwaysshared", "yes"), ("AcceptSetDesktopSize", 1),
+               ("desktop", "XFCE Desktop")])
+
+def create_vnc_config(preset="lan", session=None):
+    session = session or sessions.default_session()
+    print(f"⚙️  Creating VNC configuration ({preset} preset)...")
+    config_path = os.path.join(session["state_dir"], "config")
+    lines = ["# TigerVNC Configuration"] + [f"{key}={value}" for key, value in vnc_settings(preset)]
+    config_files.write_if_changed(config_path, "\n".join(lines) + "\n", 0o644)
+
+def vnc_command(preset="lan", session=None):
+    """The vncserver command line for a session.
+
+    vncserver only reads ~/.vnc/config, which extra sessions don't use, so
+    every setting is passed on the command line as well.
+    """
+    session = session or sessions.default_session()
+    vnc_cmd = ["vncserver", f":{session['display']}"]
+    for key, value in vnc_settings(preset):
+        vnc_cmd += [f"-{key}", str(value)] if key in VNCSERVER_OPTIONS else [f"-{key}={value}"]
+    if session["name"] != sessions.DEFAULT_NAME:
+        # Extra sessions keep their password and startup script in their own state dir
+        vnc_cmd += ["-xstartup", os.path.join(session["state_dir"], "xstartup"),
+                    "-PasswordFile", os.path.join(session["state_dir"], "passwd"),
+                    "-rfbport", str(session["vnc_port"])]
+    return vnc_cmd
 
 def configure_xfce_settings():
     print("🔧 Configuring XFCE settings...")
     
-    # Create XFCE config directory
+    # XFCE config directory
     xfce_config = os.path.expanduser("~/.config/xfce4/xfconf/xfce-perchannel-xml")
-    os.makedirs(xfce_config, exist_ok=True)
     
     # Disable screensaver
-    xfce4_screensaver = os.path.join(xfce_config, "xfce4-screensaver.xml")
-    with open(xfce4_screensaver, "w") as f:
-        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f.write('<channel name="xfce4-screensaver" version="1.0">\n')
-        f.write('  <property name="saver" type="empty">\n')
-        f.write('    <property name="enabled" type="bool" value="false"/>\n')
-        f.write('    <property name="mode" type="int" value="0"/>\n')
-        f.write('  </property>\n')
-        f.write('  <property name="lock" type="empty">\n')
-        f.write('    <property name="enabled" type="bool" value="false"/>\n')
-        f.write('  </property>\n')
-        f.write('</channel>\n')
+    config_files.write_if_changed(os.path.join(xfce_config, "xfce4-screensaver.xml"), (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<channel name="xfce4-screensaver" version="1.0">\n'
+        '  <property name="saver" type="empty">\n'
+        '    <property name="enabled" type="bool" value="false"/>\n'
+        '    <property name="mode" type="int" value="0"/>\n'
+        '  </property>\n'
+        '  <property name="lock" type="empty">\n'
+        '    <property name="enabled" type="bool" value="false"/>\n'
+        '  </property>\n'
+        '</channel>\n'
+    ))
     
     # Disable power management
-    xfce4_power = os.path.join(xfce_config, "xfce4-power-manager.xml")
-    with open(xfce4_power, "w") as f:
-        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f.write('<channel name="xfce4-power-manager" version="1.0">\n')
-        f.write('  <property name="xfce4-power-manager" type="empty">\n')
-        f.write('    <property name="dpms-enabled" type="bool" value="false"/>\n')
-        f.write('    <property name="blank-on-ac" type="int" value="0"/>\n')
-        f.write('  </property>\n')
-        f.write('</channel>\n')
+    config_files.write_if_changed(os.path.join(xfce_config, "xfce4-power-manager.xml"), (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<channel name="xfce4-power-manager" version="1.0">\n'
+        '  <property name="xfce4-power-manager" type="empty">\n'
+        '    <property name="dpms-enabled" type="bool" value="false"/>\n'
+        '    <property name="blank-on-ac" type="int" value="0"/>\n'
+        '  </property>\n'
+        '</channel>\n'
+    ))
     
     print("✅ XFCE configured - screensaver and lock screen disabled")
 
@@ -320,139 +871,367 @@ def disable_problematic_services():
     """Kill and prevent services that can cause disconnections"""
     print("🛡️  Disabling problematic services...")
     
-    run("pkill -9 xfce4-screensaver", check=False)
-    run("pkill -9 light-locker", check=False)
-    run("pkill -9 xscreensaver", check=False)
-    run("pkill -9 gnome-screensaver", check=False)
+    screensavers = ["xfce4-screensaver", "light-locker", "gnome-screensaver", "xscreensaver"]
+    proc_control.kill_matching(names=screensavers, sig=signal.SIGKILL)
     
     # Disable screensaver autostart
     autostart_dir = os.path.expanduser("~/.config/autostart")
-    os.makedirs(autostart_dir, exist_ok=True)
-    
-    for app in ["xfce4-screensaver", "light-locker", "gnome-screensaver", "xscreensaver"]:
-        disabled_file = os.path.join(autostart_dir, f"{app}.desktop")
-        with open(disabled_file, "w") as f:
-            f.write(f"[Desktop Entry]\nName={app}\nHidden=true\n")
+    for app in screensavers:
+        config_files.write_if_changed(os.path.join(autostart_dir, f"{app}.desktop"),
+                                      f"[Desktop Entry]\nName={app}\nHidden=true\n")
     
     print("✅ Problematic services disabled")
 
-def create_desktop_icons():
-    """Create desktop shortcuts for all installed applications"""
+# Autostart entries of background services that are no use in a VNC session
+PERFORMANCE_AUTOSTART_OFF = [
+    "at-spi-dbus-bus", "blueman", "geoclue-demo-agent", "nm-applet", "print-applet",
+    "tracker-miner-fs-3", "update-notifier", "xfce4-power-manager", "xiccd",
+]
+
+def performance_profile_channels():
+    """{path: (channel, properties)} of the xfconf settings the performance profile changes"""
+    xfce_config = os.path.expanduser("~/.config/xfce4/xfconf/xfce-perchannel-xml")
+    # No wallpaper (a flat colour compresses to almost nothing) on Xvnc's monitor
+    backdrop = {}
+    for monitor in ("monitorVNC-0", "monitor0"):
+        for workspace in range(4):
+            prefix = f"backdrop/screen0/{monitor}/workspace{workspace}"
+            backdrop[f"{prefix}/image-style"] = ("int", 0)
+            backdrop[f"{prefix}/color-style"] = ("int", 0)
+    channels = {
+        # No compositing or shadows, and windows are moved/resized as outlines,
+        # so dragging a window doesn't repaint (and send) its contents every frame
+        "xfwm4": {
+            "general/use_compositing": ("bool", "false"),
+            "general/show_dock_shadow": ("bool", "false"),
+            "general/show_frame_shadow": ("bool", "false"),
+            "general/show_popup_shadow": ("bool", "false"),
+            "general/box_move": ("bool", "true"),
+            "general/box_resize": ("bool", "true"),
+            "general/zoom_desktop": ("bool", "false"),
+        },
+        # No animations, event sounds or blinking cursors (each blink is a screen update)
+        "xsettings": {
+            "Net/CursorBlink": ("bool", "false"),
+            "Net/EnableEventSounds": ("bool", "false"),
+            "Net/EnableInputFeedbackSounds": ("bool", "false"),
+            "Gtk/EnableAnimations": ("bool", "false"),
+        },
+        "xfce4-desktop": {
+            **backdrop,
+            "desktop-icons/show-thumbnails": ("bool", "false"),
+        },
+        "thunar": {
+            "misc/thumbnail-mode": ("string", "THUNAR_THUMBNAIL_MODE_NEVER"),
+        },
+    }
+    return {os.path.join(xfce_config, f"{channel}.xml"): (channel, properties)
+            for channel, properties in channels.items()}
+
+def performance_profile_files():
+    """{path: content} of the whole files the performance profile writes"""
+    files = {
+        # Keep D-Bus from activating tumblerd to generate thumbnails
+        os.path.expanduser("~/.local/share/dbus-1/services/org.freedesktop.thumbnails.Thumbnailer1.service"): (
+            "[D-BUS Service]\n"
+            "Name=org.freedesktop.thumbnails.Thumbnailer1\n"
+            "Exec=/bin/false\n"
+        ),
+    }
+    autostart_dir = os.path.expanduser("~/.config/autostart")
+    for app in PERFORMANCE_AUTOSTART_OFF:
+        files[os.path.join(autostart_dir, f"{app}.desktop")] = f"[Desktop Entry]\nName={app}\nHidden=true\n"
+    return files
+
+def performance_profile_active():
+    return (all(xfconf.has(path, properties) for path, (_, properties) in performance_profile_channels().items())
+            and all(config_files.file_hash(path) == config_files.content_hash(content)
+                    for path, content in performance_profile_files().items()))
+
+def configure_performance_profile(enabled=True):
+    """Turn off compositing, animations, thumbnails, the wallpaper and idle daemons
+
+    The settings are merged into XFCE's channel files, so the user's own
+    settings stay. With enabled=False the profile's settings and files are
+    taken out again (anything that was changed since is left alone).
+    """
+    channels = performance_profile_channels()
+    files = performance_profile_files()
+    if not enabled:
+        changed = sum(xfconf.remove(path, properties) for path, (_, properties) in channels.items())
+        changed += sum(config_files.file_hash(path) == config_files.content_hash(content)
+                       and proc_control.remove_file(path) for path, content in files.items())
+        if changed:
+            print(f"🎨 Performance profile off, restored XFCE defaults ({changed} files updated)")
+        return
+    print("⚡ Applying the performance profile (no compositing, animations, thumbnails or wallpaper)...")
+    changed = sum(xfconf.merge(path, channel, properties) for path, (channel, properties) in channels.items())
+    changed += sum(config_files.write_if_changed(path, content) for path, content in files.items())
+    print(f"✅ Performance profile applied ({changed} files updated)")
+
+IDLE_REPORT = os.path.join(STATE_DIR, "idle_report.json")
+
+def idle_report(seconds=30, session=None):
+    """Measure the idle desktop's CPU and memory use, and compare with the profile on/off"""
+    session = session or sessions.default_session()
+    label = "performance profile" if performance_profile_active() else "default settings"
+    print(f"📏 Measuring idle CPU and memory of display :{session['display']} for {seconds}s ({label})...")
+    print("   Leave the desktop alone until this finishes")
+    usage = proc_stats.measure(session["display"], [proc_control.xvnc_pattern(session["display"]),
+                                                    proc_control.proxy_pattern(session["web_port"])], seconds)
+    if not usage:
+        raise Exception(f"No processes found for display :{session['display']}. Is the desktop running?")
+
+    print(f"\n{'PROCESS':<28}{'COUNT':>6}{'CPU %':>8}{'RSS MB':>9}")
+    for name, entry in sorted(usage.items(), key=lambda item: -item[1]["rss_mb"]):
+        print(f"{name:<28}{entry['processes']:>6}{entry['cpu_percent']:>8.2f}{entry['rss_mb']:>9.1f}")
+    total_cpu = round(sum(entry["cpu_percent"] for entry in usage.values()), 2)
+    total_rss = round(sum(entry["rss_mb"] for entry in usage.values()), 1)
+    print(f"{'TOTAL':<28}{sum(e['processes'] for e in usage.values()):>6}{total_cpu:>8.2f}{total_rss:>9.1f}")
+
+    try:
+        with open(IDLE_REPORT) as f:
+            reports = json.load(f)
+    except (OSError, ValueError):
+        reports = {}
+    reports[label] = {"measured": time.time(), "seconds": seconds, "cpu_percent": total_cpu,
+                      "rss_mb": total_rss, "processes": usage}
+    os.makedirs(STATE_DIR, exist_ok=True)
+    config_files.write_if_changed(IDLE_REPORT, json.dumps(reports, indent=2))
+
+    if len(reports) == 2:
+        before, after = reports["default settings"], reports["performance profile"]
+        print(f"\n📊 Default settings → performance profile: "
+              f"CPU {before['cpu_percent']:.2f}% → {after['cpu_percent']:.2f}%, "
+              f"memory {before['rss_mb']:.0f} MB → {after['rss_mb']:.0f} MB")
+    else:
+        other = "on" if label == "default settings" else "off (--no-performance-profile)"
+        print(f"\n💡 Restart the desktop with the performance profile {other} and run this again to compare")
+
+LAZY_LAUNCHER = os.path.join(BIN_DIR, "desktop-lazy-launch")
+
+def create_lazy_launcher():
+    """Write the wrapper that installs an app's package group on first launch"""
+    script = os.path.abspath(__file__)
+    config_files.write_if_changed(LAZY_LAUNCHER, (
+        "#!/bin/bash\n"
+        "# Usage: desktop-lazy-launch <package group> <program> <command> [args...]\n"
+        "# Installs the package group if program is missing, then runs the real app\n"
+        "GROUP=\"$1\"\n"
+        "PROGRAM=\"$2\"\n"
+        "shift 2\n"
+        "if ! command -v \"$PROGRAM\" >/dev/null 2>&1; then\n"
+        f"    INSTALL=(python3 \"{script}\" install-group \"$GROUP\")\n"
+        "    if command -v xfce4-terminal >/dev/null 2>&1; then\n"
+        "        xfce4-terminal --disable-server --title=\"Installing $GROUP...\" -x \"${INSTALL[@]}\"\n"
+        "    else\n"
+        "        xterm -T \"Installing $GROUP...\" -e \"${INSTALL[@]}\"\n"
+        "    fi\n"
+        "fi\n"
+        "exec \"$@\"\n"
+    ), 0o755)
+
+def browser_cache_dir():
+    """Where the browsers keep their disk cache: /dev/shm (RAM) when it has room, else /tmp"""
+    root = tempfile.gettempdir()
+    try:
+        stat = os.statvfs("/dev/shm")
+        # Docker gives containers a 64 MB /dev/shm by default, too small to share
+        if stat.f_bavail * stat.f_frsize >= 4 * 2 * BROWSER_CACHE_MB * 1024 * 1024:
+            root = "/dev/shm"
+    except OSError:
+        pass
+    return os.path.join(root, f"desktop-browser-cache-{os.environ.get('USER', 'root')}")
+
+def create_browser_launchers(cache_dir=None):
+    """Write the Chromium and Firefox wrappers the desktop icons start.
+
+    There is no GPU under Xvnc, so both render in software straight away
+    instead of probing for one. Smooth scrolling and animations are off since
+    every animated frame has to be encoded and sent to the viewer. The number
+    of renderer processes and the size of each JavaScript heap are capped, and
+    the disk cache lives in RAM with a size limit (in cache_dir, if given).
+    """
+    cache_dir = cache_dir or browser_cache_dir()
+    cache_bytes = BROWSER_CACHE_MB * 1024 * 1024
+    chromium_flags = [
+        "--no-sandbox",
+        "--disable-gpu",
+        "--disable-dev-shm-usage",
+        "--disable-smooth-scrolling",
+        "--force-prefers-reduced-motion",
+        f"--renderer-process-limit={BROWSER_RENDERER_LIMIT}",
+        f"--js-flags=--max-old-space-size={BROWSER_HEAP_MB}",
+        f"--disk-cache-dir={cache_dir}/chromium",
+        f"--disk-cache-size={cache_bytes}",
+    ]
+    config_files.write_if_changed(CHROMIUM_LAUNCHER, (
+        "#!/bin/bash\n"
+        "# Chromium tuned for the VNC desktop (generated by desktop_toggle.py)\n"
+        "BROWSER=$(command -v chromium || command -v chromium-browser) || { echo \"Chromium is not installed\" >&2; exit 127; }\n"
+        f"mkdir -p -m 700 \"{cache_dir}/chromium\"\n"
+        "exec \"$BROWSER\" " + " ".join(chromium_flags) + " \"$@\"\n"
+    ), 0o755)
+
+    firefox_prefs = {
+        "gfx.webrender.software": True,
+        "layers.acceleration.disabled": True,
+        "general.smoothScroll": False,
+        "ui.prefersReducedMotion": 1,
+        "toolkit.cosmeticAnimations.enabled": False,
+        "fission.autostart": False,
+        "dom.ipc.processCount": BROWSER_RENDERER_LIMIT,
+        "javascript.options.mem.max": BROWSER_HEAP_MB * 1024,
+        "browser.cache.disk.parent_directory": f"{cache_dir}/firefox",
+        "browser.cache.disk.smart_size.enabled": False,
+        "browser.cache.disk.capacity": cache_bytes // 1024,
+        "browser.sessionhistory.max_total_viewers": 0,
+        "browser.tabs.unloadOnLowMemory": True,
+    }
+    config_files.write_if_changed(os.path.join(FIREFOX_PROFILE, "user.js"), "".join(
+        f"user_pref(\"{name}\", {json.dumps(value)});\n" for name, value in firefox_prefs.items()
+    ))
+    config_files.write_if_changed(FIREFOX_LAUNCHER, (
+        "#!/bin/bash\n"
+        "# Firefox with the VNC desktop's tuned profile (generated by desktop_toggle.py)\n"
+        "command -v firefox-esr >/dev/null || { echo \"Firefox is not installed\" >&2; exit 127; }\n"
+        f"mkdir -p -m 700 \"{cache_dir}/firefox\"\n"
+        f"exec firefox-esr --profile \"{FIREFOX_PROFILE}\" \"$@\"\n"
+    ), 0o755)
+
+def create_desktop_icons(lazy=False, browser_cache=None):
+    """Create desktop shortcuts for all installed applications
+
+    With lazy=True, apps that aren't installed yet still get an icon whose
+    Exec= goes through the lazy launcher, which installs them on first click.
+    """
     print("🖼️  Creating desktop icons...")
+    if lazy:
+        create_lazy_launcher()
+    create_browser_launchers(browser_cache)
     
     desktop_dir = os.path.expanduser("~/Desktop")
-    os.makedirs(desktop_dir, exist_ok=True)
-    
-    desktop_entries = [
-        # Browsers
-        {"name": "Firefox", "exec": "firefox-esr", "check": "firefox-esr", "icon": "firefox-esr", "comment": "Web Browser"},
-        {"name": "Chromium", "exec": "chromium --no-sandbox", "check": ["chromium", "chromium-browser"], "icon": "chromium", "comment": "Chromium Web Browser"},
-        # File Management
-        {"name": "Files", "exec": "thunar", "check": "thunar", "icon": "system-file-manager", "comment": "File Manager"},
-        {"name": "Archive Manager", "exec": "file-roller", "check": "file-roller", "icon": "org.gnome.FileRoller", "comment": "Create and extract archives"},
-        # Office
-        {"name": "LibreOffice Writer", "exec": "libreoffice --writer", "check": "libreoffice", "icon": "libreoffice-writer", "comment": "Word Processor"},
-        {"name": "LibreOffice Calc", "exec": "libreoffice --calc", "check": "libreoffice", "icon": "libreoffice-calc", "comment": "Spreadsheet"},
-        {"name": "LibreOffice Impress", "exec": "libreoffice --impress", "check": "libreoffice", "icon": "libreoffice-impress", "comment": "Presentations"},
-        {"name": "PDF Viewer", "exec": "evince", "check": "evince", "icon": "org.gnome.Evince", "comment": "View PDF documents"},
-        {"name": "Calculator", "exec": "galculator", "check": "galculator", "icon": "galculator", "comment": "Calculator"},
-        # Text Editors
-        {"name": "Mousepad", "exec": "mousepad", "check": "mousepad", "icon": "mousepad", "comment": "Simple Text Editor"},
-        {"name": "Geany", "exec": "geany", "check": "geany", "icon": "geany", "comment": "IDE and Text Editor"},
-        # Media
-        {"name": "Image Viewer", "exec": "ristretto", "check": "ristretto", "icon": "ristretto", "comment": "View Images"},
-        {"name": "GIMP", "exec": "gimp", "check": "gimp", "icon": "gimp", "comment": "Image Editor"},
-        {"name": "Inkscape", "exec": "inkscape", "check": "inkscape", "icon": "inkscape", "comment": "Vector Graphics Editor"},
-        {"name": "VLC Media Player", "exec": "vlc", "check": "vlc", "icon": "vlc", "comment": "Play Videos and Music"},
-        {"name": "Audacious", "exec": "audacious", "check": "audacious", "icon": "audacious", "comment": "Music Player"},
-        # System Tools
-        {"name": "Terminal", "exec": "xfce4-terminal", "check": "xfce4-terminal", "icon": "utilities-terminal", "comment": "Terminal Emulator"},
-        {"name": "Task Manager", "exec": "xfce4-taskmanager", "check": "xfce4-taskmanager", "icon": "utilities-system-monitor", "comment": "Monitor System Resources"},
-        {"name": "System Monitor", "exec": "gnome-system-monitor", "check": "gnome-system-monitor", "icon": "utilities-system-monitor", "comment": "View System Resources"},
-        {"name": "Disk Usage", "exec": "baobab", "check": "baobab", "icon": "baobab", "comment": "Analyze Disk Usage"},
-        {"name": "Disks", "exec": "gnome-disks", "check": "gnome-disks", "icon": "gnome-disks", "comment": "Disk Management"},
-        {"name": "GParted", "exec": "gparted", "check": "gparted", "icon": "gparted", "comment": "Partition Editor"},
-        {"name": "Screenshot", "exec": "xfce4-screenshooter", "check": "xfce4-screenshooter", "icon": "applets-screenshooter", "comment": "Take Screenshots"},
-        {"name": "Flameshot", "exec": "flameshot gui", "check": "flameshot", "icon": "flameshot", "comment": "Advanced Screenshot Tool"},
-        # Development
-        {"name": "Meld", "exec": "meld", "check": "meld", "icon": "meld", "comment": "Diff and Merge Tool"},
-        {"name": "Gitg", "exec": "gitg", "check": "gitg", "icon": "gitg", "comment": "Git Repository Viewer"},
-        # Network
-        {"name": "Transmission", "exec": "transmission-gtk", "check": "transmission-gtk", "icon": "transmission", "comment": "BitTorrent Client"},
-        {"name": "FileZilla", "exec": "filezilla", "check": "filezilla", "icon": "filezilla", "comment": "FTP Client"},
-        # Wine
-        {"name": "Wine Configuration", "exec": "winecfg", "check": "winecfg", "icon": "wine", "comment": "Configure Wine"},
-        {"name": "Wine File Manager", "exec": "wine explorer", "check": "wine", "icon": "wine", "comment": "Wine File Explorer"},
-        # Bluetooth
-        {"name": "Bluetooth Manager", "exec": "blueman-manager", "check": "blueman-manager", "icon": "bluetooth", "comment": "Manage Bluetooth Devices"},
-    ]
     
-    # Only create icons for apps that are actually installed
+    # Only create icons for apps that are actually installed (or lazy-installable)
     created_count = 0
     skipped_count = 0
+    lazy_count = 0
+    changed_files = []
     
-    for entry in desktop_entries:
-        # Check if the app is installed
-        check_cmd = entry.get('check', entry['exec'].split()[0])
-        
-        if isinstance(check_cmd, list):
-            is_installed = any(shutil.which(cmd) for cmd in check_cmd)
-        else:
-            is_installed = shutil.which(check_cmd) is not None
+    for entry in APPS:
+        if not entry["exec"]:
+            continue
+        is_installed = app_installed(entry)
         
+        exec_cmd = entry['exec']
         if not is_installed:
-            skipped_count += 1
-            continue
+            if not lazy:
+                skipped_count += 1
+                continue
+            program = entry["check"][0] if isinstance(entry["check"], list) else entry["check"]
+            exec_cmd = f'{LAZY_LAUNCHER} "{entry["group"]}" {program} {exec_cmd}'
+            lazy_count += 1
         
         filename = entry['name'].replace(' ', '-').replace('(', '').replace(')', '')
         desktop_file = os.path.join(desktop_dir, f"{filename}.desktop")
-        with open(desktop_file, "w") as f:
-            f.write("[Desktop Entry]\n")
-            f.write("Version=1.0\n")
-            f.write("Type=Application\n")
-            f.write(f"Name={entry['name']}\n")
-            f.write(f"Exec={entry['exec']}\n")
-            f.write(f"Icon={entry['icon']}\n")
-            f.write(f"Comment={entry['comment']}\n")
-            f.write("Terminal=false\n")
-            f.write("StartupNotify=true\n")
-        os.chmod(desktop_file, 0o755)
+        content = (
+            "[Desktop Entry]\n"
+            "Version=1.0\n"
+            "Type=Application\n"
+            f"Name={entry['name']}\n"
+            f"Exec={exec_cmd}\n"
+            f"Icon={entry['icon']}\n"
+            f"Comment={entry['comment']}\n"
+            "Terminal=false\n"
+            "StartupNotify=true\n"
+        )
+        if config_files.write_if_changed(desktop_file, content, 0o755):
+            changed_files.append(desktop_file)
         created_count += 1
     
-    run("chmod +x ~/Desktop/*.desktop", check=False)
-    
-    # Trust desktop files for XFCE
-    run("gio set ~/Desktop/*.desktop metadata::trusted true 2>/dev/null", check=False)
+    # Trust the new or changed desktop files for XFCE (one gio call for all of them)
+    if changed_files and proc_control.which("gio"):
+        timing.count_subprocess()
+        subprocess.run(["gio", "set"] + changed_files + ["metadata::trusted", "true"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     
-    print(f"✅ Created {created_count} desktop icons ({skipped_count} apps not installed)")
+    if lazy:
+        print(f"✅ Created {created_count} desktop icons ({lazy_count} install on first launch, "
+              f"{len(changed_files)} updated)")
+    else:
+        print(f"✅ Created {created_count} desktop icons ({skipped_count} apps not installed, "
+              f"{len(changed_files)} updated)")
 
-def start_vnc():
+def in_cgroup(cmd, cgroup):
+    """cmd, made to move itself into cgroup before it runs (if there is one)"""
+    if not cgroup:
+        return cmd
+    return ["sh", "-c", f'echo $$ > "{cgroup}/cgroup.procs"; exec "$@"', "sh"] + cmd
+
+def start_vnc(preset="lan", session=None, vnc_log=None, cgroup=None):
+    session = session or sessions.default_session()
+    display, vnc_port = session["display"], session["vnc_port"]
+    vnc_log = vnc_log or session["vnc_log"]
     print("🚀 Starting VNC server...")
+    vnc_cmd = in_cgroup(vnc_command(preset, session), cgroup)
     os.environ["USER"] = os.environ.get("USER", "root")
     
-    # Start VNC server
-    os.system("vncserver :1 -geometry 1920x1080 -depth 24 > /tmp/vncserver.log 2>&1 &")
-    
-    # Wait for VNC to be ready
-    time.sleep(4)
+    # Start VNC server (vncserver forks Xvnc and exits once it is launched)
+    timing.count_subprocess()
+    with log_rotation.open_log(vnc_log) as log:
+        proc = subprocess.Popen(vnc_cmd, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                start_new_session=True)
     
-    # Check if VNC is running
-    check_result = run("pgrep -f 'Xvnc.*:1'", check=False)
-    if check_result.returncode == 0:
-        print("✅ VNC server started on display :1 (port 5901)")
-    else:
-        print("❌ VNC server failed to start. Check /tmp/vncserver.log")
-        if os.path.exists("/tmp/vncserver.log"):
-            with open("/tmp/vncserver.log") as f:
+    # Wait for the X socket and a real RFB handshake on the VNC port
+    try:
+        with timing.phase("wait: VNC ready", "wait"):
+            waited = readiness.wait_for_vnc(display, vnc_port, timeout=30, proc=proc)
+    except Exception as e:
+        print(f"❌ VNC server failed to start ({e}). Check {vnc_log}")
+        if os.path.exists(vnc_log):
+            with open(vnc_log) as f:
                 print(f.read())
         raise Exception("VNC server failed to start")
+    print(f"✅ VNC server started on display :{display} (port {vnc_port}) in {waited:.1f}s")
+    return find_xvnc_pid(display)
+
+def find_xvnc_pid(display=1):
+    """Pid of the running Xvnc for a display (from vncserver's pid file, else /proc)"""
+    for pid_file in glob.glob(os.path.expanduser(f"~/.vnc/*:{display}.pid")):
+        try:
+            with open(pid_file) as f:
+                pid = int(f.read().strip())
+            if proc_control.pid_alive(pid):
+                return pid
+        except (OSError, ValueError):
+            pass
+    pids = proc_control.find_pids(proc_control.xvnc_pattern(display))
+    return pids[0] if pids else None
+
+def restart_vnc(preset="lan", session=None, vnc_log=None, cgroup=None):
+    """Clean up after a dead Xvnc and start a fresh one"""
+    session = session or sessions.default_session()
+    proc_control.kill_matching(proc_control.xvnc_pattern(session["display"]), sig=signal.SIGKILL)
+    proc_control.remove_display_files(session["display"])
+    return start_vnc(preset, session, vnc_log, cgroup)
 
-def start_novnc():
+WS_PROXY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ws_proxy.py")
+PROXY_STATS = sessions.default_session()["proxy_stats"]
+
+def start_novnc(proxy="websockify", session=None, log_path=None, cgroup=None):
+    """Start the WebSocket proxy in front of VNC
+
+    proxy is "websockify" (the external package) or "builtin" (ws_proxy.py,
+    which needs nothing beyond Python and reports per-viewer stats).
+    """
+    session = session or sessions.default_session()
+    web_port, vnc_port = session["web_port"], session["vnc_port"]
     print("🌐 Starting noVNC web interface...")
     
     # Check if websockify is installed
-    websockify_check = run("which websockify", check=False)
-    if websockify_check.returncode != 0:
+    if proxy == "builtin":
+        print("✅ Using the built-in WebSocket proxy")
+    elif not proc_control.which("websockify"):
         print("⚠️  websockify not found, installing...")
         print("="*60)
         run_install("sudo apt-get update -y")
@@ -460,16 +1239,15 @@ def start_novnc():
         print("="*60)
         
         # Verify installation
-        websockify_check = run("which websockify", check=False)
-        if websockify_check.returncode != 0:
+        if not proc_control.which("websockify"):
             # Try pip install as fallback
             print("⚠️  Trying pip install...")
             run_install("pip3 install websockify")
-            websockify_check = run("which websockify", check=False)
-            if websockify_check.returncode != 0:
+            if not proc_control.which("websockify"):
                 raise Exception("Failed to install websockify")
     
-    print("✅ websockify is available")
+    if proxy != "builtin":
+        print("✅ websockify is available")
     
     # Find noVNC path - check multiple possible locations
     novnc_paths = [
@@ -504,109 +1282,470 @@ def start_novnc():
             print("⚠️  noVNC path not found, using websockify without web UI")
             novnc_path = None
     
-    log_path = os.path.expanduser("~/.novnc.log")
+    log_path = log_path or session["novnc_log"]
     
-    # Kill any existing websockify process
-    run("pkill -f websockify", check=False)
-    time.sleep(1)
+    # Kill any existing proxy process and wait for it to release the port
+    proc_control.kill_matching(proc_control.proxy_pattern(web_port))
+    try:
+        readiness.wait_for_port_free(web_port)
+    except Exception:
+        print(f"⚠️  Port {web_port} is still in use, trying anyway...")
     
-    # Start websockify in background
-    if novnc_path:
-        websockify_cmd = f"nohup websockify --web={novnc_path} 6080 localhost:5901 > {log_path} 2>&1 &"
-        print(f"→ Starting: websockify --web={novnc_path} 6080 localhost:5901")
+    # Start the proxy in background
+    if proxy == "builtin":
+        os.makedirs(os.path.dirname(session["proxy_stats"]), exist_ok=True)
+        proxy_name = "built-in proxy"
+        proxy_cmd = [sys.executable, WS_PROXY, "--stats-file", session["proxy_stats"]]
     else:
-        # Run without --web parameter if noVNC not available
-        websockify_cmd = f"nohup websockify 6080 localhost:5901 > {log_path} 2>&1 &"
-        print(f"→ Starting: websockify 6080 localhost:5901 (without web UI)")
-    
-    os.system(websockify_cmd)
+        proxy_name = "websockify"
+        proxy_cmd = ["websockify"]
+    if novnc_path:
+        proxy_cmd.append(f"--web={novnc_path}")
+    proxy_cmd += [str(web_port), f"localhost:{vnc_port}"]
+    print(f"→ Starting: {' '.join(proxy_cmd)}" + ("" if novnc_path else " (without web UI)"))
     
-    # Wait and verify it started
-    time.sleep(3)
+    timing.count_subprocess()
+    with log_rotation.open_log(log_path) as log:
+        proc = subprocess.Popen(in_cgroup(proxy_cmd, cgroup), stdout=log, stderr=subprocess.STDOUT,
+                                stdin=subprocess.DEVNULL, start_new_session=True)
     
-    for attempt in range(5):
-        result = run("pgrep -f websockify", check=False)
-        if result.returncode == 0:
-            # Double-check the port is listening
-            port_check = run("netstat -tuln | grep :6080 || ss -tuln | grep :6080", check=False)
-            if port_check.returncode == 0:
-                print("✅ websockify started successfully on port 6080")
-                if novnc_path:
-                    print("✅ noVNC web interface is available")
-                return
-            else:
-                print(f"⚠️  Attempt {attempt+1}: Port 6080 not ready yet, waiting...")
-                time.sleep(2)
-        else:
-            print(f"⚠️  Attempt {attempt+1}: websockify process not found, waiting...")
-            time.sleep(2)
+    # Wait until it answers HTTP on the web port
+    try:
+        with timing.phase("wait: web port ready", "wait"):
+            waited = readiness.wait_for_http(web_port, timeout=20, proc=proc)
+        print(f"✅ {proxy_name} started successfully on port {web_port} in {waited:.1f}s")
+        if novnc_path:
+            print("✅ noVNC web interface is available")
+        return proc
+    except Exception as e:
+        print(f"❌ Warning: Could not verify {proxy_name} is running properly ({e})")
     
-    # If we get here, something went wrong
-    print(f"❌ Warning: Could not verify websockify is running properly")
     print(f"📝 Check log file: {log_path}")
     if os.path.exists(log_path):
         print("\n--- Log output ---")
         with open(log_path) as f:
             print(f.read())
         print("--- End log ---\n")
-    raise Exception("websockify failed to start properly")
+    raise Exception(f"{proxy_name} failed to start properly")
 
-def get_preview_url():
+def get_preview_url(preset=None, web_port=6080):
     """Get the GitHub Codespaces preview URL"""
     hostname = os.uname().nodename
-    return f"https://{hostname}-6080.app.github.dev"
+    url = f"https://{hostname}-{web_port}.app.github.dev"
+    if preset:
+        settings = VNC_PRESETS[preset]
+        url += f"/vnc.html?quality={settings['quality']}&compression={settings['compression']}&resize=remote"
+    return url
+
+def session_name(value):
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", value):
+        raise argparse.ArgumentTypeError("session names may only contain letters, digits, '-' and '_'")
+    return value
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Start an XFCE desktop reachable through noVNC")
+    parser.add_argument("--profile", default=os.environ.get("DESKTOP_PROFILE"),
+                        help="install profile: minimal, standard or full (env: DESKTOP_PROFILE, default: full, or minimal with --lazy)")
+    parser.add_argument("--lazy", action="store_true", default=os.environ.get("DESKTOP_LAZY") == "1",
+                        help="create icons for apps outside the profile that install on first launch (env: DESKTOP_LAZY=1)")
+    parser.add_argument("--proxy", choices=["websockify", "builtin"],
+                        default=os.environ.get("DESKTOP_PROXY", "websockify"),
+                        help="WebSocket proxy for noVNC: the websockify package or the built-in ws_proxy.py (env: DESKTOP_PROXY)")
+    parser.add_argument("--preset", choices=list(VNC_PRESETS) + ["auto"],
+                        default=os.environ.get("DESKTOP_PRESET", "lan"),
+                        help="VNC performance preset; auto picks one from the RTT measured by --proxy builtin (env: DESKTOP_PRESET)")
+    parser.add_argument("--apt-cache", default=os.environ.get("DESKTOP_APT_CACHE"),
+                        help="keep downloaded .debs in this directory (e.g. a persistent volume) and reuse them on rebuilds (env: DESKTOP_APT_CACHE)")
+    parser.add_argument("--apt-cache-mb", type=int, default=int(os.environ.get("DESKTOP_APT_CACHE_MB", DEFAULT_APT_CACHE_MB)),
+                        help=f"size cap for --apt-cache, least recently used .debs are pruned first (default: {DEFAULT_APT_CACHE_MB})")
+    parser.add_argument("--serial", action="store_true",
+                        help="run the startup steps one after another instead of in parallel (for debugging)")
+    parser.add_argument("--no-performance-profile", dest="performance", action="store_false",
+                        default=os.environ.get("DESKTOP_PERFORMANCE", "1") != "0",
+                        help="keep XFCE's compositing, animations, thumbnails and wallpaper (env: DESKTOP_PERFORMANCE=0)")
+    parser.add_argument("--cgroups", action="store_true", default=os.environ.get("DESKTOP_CGROUPS") == "1",
+                        help="run Xvnc/websockify and the desktop's apps in separate cgroups with their own limits (env: DESKTOP_CGROUPS=1)")
+    parser.add_argument("--display-cpu-weight", type=int, default=1000,
+                        help="with --cgroups, CPU weight of Xvnc and websockify (default: 1000)")
+    parser.add_argument("--apps-cpu-weight", type=int, default=100,
+                        help="with --cgroups, CPU weight of the desktop and its apps (default: 100)")
+    parser.add_argument("--apps-memory-max", default=os.environ.get("DESKTOP_APPS_MEMORY_MAX", "max"),
+                        help="with --cgroups, memory limit of the desktop and its apps, e.g. 4G (env: DESKTOP_APPS_MEMORY_MAX, default: no limit)")
+    parser.add_argument("--tmpfs-mb", type=int, default=int(os.environ.get("DESKTOP_TMPFS_MB", 0)),
+                        help="keep caches (XDG_CACHE_HOME) and server logs on a tmpfs of this size instead of the disk "
+                             "(env: DESKTOP_TMPFS_MB, default: off)")
+    parser.add_argument("--trace", action="store_true", default=os.environ.get("DESKTOP_TRACE") == "1",
+                        help=f"also write a Chrome trace of the startup phases to {timing.TRACE_PATH} (env: DESKTOP_TRACE=1)")
+    subparsers = parser.add_subparsers(dest="command")
+    supervise_parser = subparsers.add_parser("supervise", help="start the desktop, then keep running and restart Xvnc/websockify if they die")
+    supervise_parser.add_argument("--idle-freeze", type=float, metavar="MINUTES",
+                                  default=float(os.environ.get("DESKTOP_IDLE_FREEZE", 0)),
+                                  help="freeze the desktop's apps after this many minutes without a viewer, "
+                                       "resume them when one connects (env: DESKTOP_IDLE_FREEZE, default: off)")
+    session_parser = subparsers.add_parser("session", help="run several independent desktops on this machine")
+    session_subparsers = session_parser.add_subparsers(dest="session_command", required=True)
+    for session_command, help_text in [("start", "start (or restart) a named desktop on its own display and ports"),
+                                       ("stop", "stop a named desktop")]:
+        session_command_parser = session_subparsers.add_parser(session_command, help=help_text)
+        session_command_parser.add_argument("name", type=session_name)
+    session_subparsers.add_parser("list", help="show all desktops and their ports")
+    build_parser = subparsers.add_parser("build-image", help="generate a Dockerfile with all packages prebaked")
+    build_parser.add_argument("--output", default=DOCKERFILE_PATH, help=f"where to write it (default: {DOCKERFILE_PATH})")
+    stats_parser = subparsers.add_parser("stats", help="show CPU, memory, viewers and traffic of the running desktops")
+    stats_parser.add_argument("--prometheus", action="store_true", help="print in the Prometheus text format")
+    metrics_parser = subparsers.add_parser("metrics-server", help="serve the stats as Prometheus metrics on a local port")
+    metrics_parser.add_argument("--port", type=int, default=METRICS_PORT, help=f"port to listen on (default: {METRICS_PORT})")
+    metrics_parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    subparsers.add_parser("cgroup-status", help="show CPU and memory use of each session's cgroups")
+    idle_parser = subparsers.add_parser("idle-report", help="measure the idle desktop's CPU and memory use")
+    idle_parser.add_argument("--seconds", type=int, default=30, help="how long to measure (default: 30)")
+    idle_parser.add_argument("--session", default=sessions.DEFAULT_NAME, type=session_name, help="which desktop to measure")
+    install_parser = subparsers.add_parser("install-group", help="install one package group (used by lazy launchers)")
+    install_parser.add_argument("group", choices=[name for name, _ in package_groups])
+    args = parser.parse_args(argv)
+    if args.preset not in VNC_PRESETS and args.preset != "auto":
+        parser.error(f"unknown preset '{args.preset}' (choose from {', '.join(VNC_PRESETS)}, auto)")
+    if args.profile is None:
+        args.profile = "minimal" if args.lazy else "full"
+    if args.profile not in INSTALL_PROFILES:
+        parser.error(f"unknown profile '{args.profile}' (choose from {', '.join(INSTALL_PROFILES)})")
+    return args
+
+def print_installed_apps(profile, lazy):
+    if profile != "full":
+        print(f"\n📦 Install profile: {profile}")
+        for group_name in INSTALL_PROFILES[profile]:
+            print(f"      • {group_name}")
+        if lazy:
+            print("\n🖼️  Other apps have desktop icons and install on first launch")
+        return
+    print("\n📦 Installed Applications:")
+    print("   🌐 BROWSERS:")
+    print("      • Firefox, Chromium")
+    print("   📁 FILE MANAGEMENT:")
+    print("      • Thunar File Manager, Archive Manager")
+    print("      • Supports: ZIP, 7z, TAR, GZIP, BZIP2, XZ, RAR")
+    print("   📝 OFFICE & PRODUCTIVITY:")
+    print("      • LibreOffice (Writer, Calc, Impress)")
+    print("      • PDF Viewer (Evince), Calculator")
+    print("   ✏️  TEXT EDITORS:")
+    print("      • Mousepad, Geany IDE")
+    print("   🎨 GRAPHICS & MEDIA:")
+    print("      • GIMP, Inkscape, Image Viewer")
+    print("      • VLC Media Player, Audacious Music Player")
+    print("   🔧 SYSTEM TOOLS:")
+    print("      • Task Manager, System Monitor")
+    print("      • Disk Usage Analyzer, GParted")
+    print("      • Screenshot Tools (Flameshot)")
+    print("   💻 DEVELOPMENT:")
+    print("      • Meld (diff/merge), Gitg (Git GUI)")
+    print("   🌐 NETWORK:")
+    print("      • Transmission (BitTorrent), FileZilla (FTP)")
+    print("   🍷 WINDOWS COMPATIBILITY:")
+    print("      • Wine + Winetricks (Run Windows .exe files)")
+    print("   📶 BLUETOOTH:")
+    print("      • Blueman Bluetooth Manager")
+    print("\n🖼️  Desktop icons have been created for all apps!")
+
+def startup_steps(args, handles):
+    """Startup steps and what each one has to wait for
+
+    The server steps store their process handles in handles for the supervisor.
+    """
+    session = args.session
+    return [
+        ("packages", lambda: check_and_install_packages(args.profile, args.apt_cache, args.apt_cache_mb), []),
+        ("kill_existing", lambda: kill_existing(session), []),
+        ("vnc_password", lambda: setup_vnc_password(session=session), ["packages"]),
+        ("disable_services", disable_problematic_services, []),
+        ("xfce_settings", configure_xfce_settings, []),
+        ("performance_profile", lambda: configure_performance_profile(args.performance), []),
+        ("cgroups", lambda: setup_cgroups(args, handles), []),
+        ("volatile", lambda: setup_volatile(args, handles), []),
+        ("xstartup", lambda: create_xstartup(session, handles.get("apps_cgroup"), volatile_cache(handles)),
+         ["cgroups", "volatile"]),
+        ("vnc_config", lambda: create_vnc_config(args.preset, session), []),
+        ("desktop_icons", lambda: create_desktop_icons(args.lazy, volatile_cache(handles, "browsers")),
+         ["packages", "volatile"]),
+        ("start_vnc", lambda: handles.update(vnc=start_vnc(args.preset, session, handles.get("vnc_log"),
+                                                             handles.get("display_cgroup"))),
+         ["packages", "kill_existing", "vnc_password", "disable_services",
+          "xfce_settings", "performance_profile", "cgroups", "volatile", "xstartup", "vnc_config"]),
+        # websockify doesn't need Xvnc to be up, only the old one to be gone
+        ("start_novnc", lambda: handles.update(novnc=start_novnc(args.proxy, session, handles.get("novnc_log"),
+                                                                 handles.get("display_cgroup"))),
+         ["packages", "kill_existing", "cgroups", "volatile"]),
+    ]
+
+def server_logs(session, handles):
+    """The logs of the session's proxy and Xvnc (vncserver's and Xvnc's own)"""
+    return ([handles.get("vnc_log") or session["vnc_log"], handles.get("novnc_log") or session["novnc_log"]]
+            + glob.glob(os.path.expanduser(f"~/.vnc/*:{session['display']}.log")))
+
+LOG_WATCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_rotation.py")
+
+def start_log_watcher(session, handles):
+    """Rotate the server logs without a supervisor, in a detached process that exits with Xvnc"""
+    if not handles.get("vnc"):
+        return None
+    timing.count_subprocess()
+    return subprocess.Popen([sys.executable, LOG_WATCHER, "--pid", str(handles["vnc"]), *server_logs(session, handles)],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+def run_supervisor(handles, args):
+    """Keep Xvnc and websockify alive, restarting whichever one dies"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    vnc_log, novnc_log, cgroup = handles.get("vnc_log"), handles.get("novnc_log"), handles.get("display_cgroup")
+    started = sessions.load_registry().get(args.session["name"], {}).get("started")
 
-def main():
+    def register():
+        # session list/stop and the metrics go by the pids in the registry
+        proxy = handles.get("novnc")
+        sessions.register(args.session, handles.get("vnc"), proxy.pid if proxy else None, started)
+
+    def restart_xvnc():
+        handles["vnc"] = restart_vnc(args.preset, args.session, vnc_log, cgroup)
+        register()
+        return handles["vnc"]
+
+    def restart_proxy():
+        handles["novnc"] = start_novnc(args.proxy, args.session, novnc_log, cgroup)
+        register()
+        return handles["novnc"]
+
+    components = [
+        supervisor.make_component("Xvnc", restart_xvnc, lambda pid: proc_control.pid_alive(pid), handles.get("vnc")),
+        supervisor.make_component("websockify", restart_proxy, lambda proc: proc.poll() is None, handles.get("novnc")),
+    ]
+    logs = log_rotation.make_watch(server_logs(args.session, handles))
+    policy = None
+    if args.idle_freeze > 0:
+        spare = [proc_control.xvnc_pattern(args.session["display"]),
+                 proc_control.proxy_pattern(args.session["web_port"])]
+        policy = idle.make_policy(args.session, args.idle_freeze * 60, spare, handles.get("apps_cgroup"))
+        print(f"💤 Apps freeze after {args.idle_freeze:g} min without a viewer")
+
+    def on_tick():
+        log_rotation.tick(logs)
+        if policy:
+            idle.tick(policy)
+
+    try:
+        supervisor.supervise(components, args.session["supervisor_state"], on_tick)
+    finally:
+        idle.thaw(args.session["name"])
+
+METRICS_PORT = 9109
+
+def collect_metrics():
+    registry = sessions.load_registry()
+    registry.setdefault(sessions.DEFAULT_NAME, sessions.default_session())
+    return metrics.collect(registry, lambda s: (proc_control.xvnc_pattern(s["display"]),
+                                                proc_control.proxy_pattern(s["web_port"])))
+
+def print_stats(samples):
+    """Human-readable version of the metrics"""
+    by_session = {}
+    for name, labels, value in samples:
+        by_session.setdefault(labels["session"], []).append((name, labels, value))
+    for session_name, session_samples in by_session.items():
+        values = {(name, labels.get("role") or labels.get("direction") or labels.get("port")
+                   or labels.get("component")): value
+                  for name, labels, value in session_samples}
+        restarts = {labels["component"]: value for name, labels, value in session_samples
+                    if name == "desktop_restarts_total"}
+        uptime = values.get(("desktop_uptime_seconds", None))
+        state = f"up {apt_progress.format_duration(uptime)}" if uptime is not None else (
+            "running" if values.get(("desktop_up", None)) else "not running")
+        print(f"🖥️  {session_name}: {state}, {values.get(('desktop_viewers', None), 0)} viewer(s)")
+        print(f"   {'ROLE':<10}{'PROCS':>6}{'CPU s':>10}{'RSS MB':>9}{'READ MB':>10}{'WRITTEN MB':>12}")
+        for role in ("xvnc", "proxy", "desktop"):
+            print(f"   {role:<10}{values[('desktop_processes', role)]:>6}"
+                  f"{values[('desktop_cpu_seconds_total', role)]:>10.1f}"
+                  f"{values[('desktop_memory_rss_bytes', role)] / 1e6:>9.0f}"
+                  f"{values[('desktop_io_read_bytes_total', role)] / 1e6:>10.1f}"
+                  f"{values[('desktop_io_written_bytes_total', role)] / 1e6:>12.1f}")
+        if ("desktop_proxy_bytes_total", "to_clients") in values:
+            print(f"   Proxy traffic: {values[('desktop_proxy_bytes_total', 'from_clients')] / 1e6:.1f} MB from viewers, "
+                  f"{values[('desktop_proxy_bytes_total', 'to_clients')] / 1e6:.1f} MB to viewers")
+        if restarts:
+            print("   🔁 Supervisor restarts: " + ", ".join(f"{name} {count}" for name, count in restarts.items()))
+
+def setup_cgroups(args, handles):
+    """Put the display servers and the apps of this session in separate cgroups (--cgroups)"""
+    if not args.cgroups:
+        return
+    print("📦 Setting up cgroups...")
     try:
-        check_and_install_packages()
-        kill_existing()
-        setup_vnc_password()
-        disable_problematic_services()
-        configure_xfce_settings()
-        create_xstartup()
-        create_vnc_config()
-        create_desktop_icons()
-        start_vnc()
-        start_novnc()
+        display_cgroup, apps_cgroup = cgroups.setup(args.session["name"], args.display_cpu_weight,
+                                                    args.apps_cpu_weight, args.apps_memory_max)
+    except Exception as e:
+        print(f"⚠️  Not using cgroups: {e}")
+        return
+    # Xvnc and the proxy join the display cgroup as they start (see in_cgroup),
+    # this process stays where it is so apt doesn't get the display's priority
+    handles["display_cgroup"] = display_cgroup
+    handles["apps_cgroup"] = apps_cgroup
+    print(f"✅ Display in {display_cgroup} (CPU weight {args.display_cpu_weight}), apps in {apps_cgroup} "
+          f"(CPU weight {args.apps_cpu_weight}, memory max {args.apps_memory_max})")
+
+def setup_volatile(args, handles):
+    """Put the session's caches and server logs on a size-capped tmpfs (--tmpfs-mb)"""
+    if not args.tmpfs_mb:
+        return
+    print(f"💾 Setting up a {args.tmpfs_mb} MB tmpfs for caches and logs...")
+    root = volatile.MOUNT_POINT
+    os.makedirs(root, exist_ok=True)
+    size = volatile.tmpfs_size(root)
+    if size != args.tmpfs_mb:
+        # Remounting keeps the files when only the size changed
+        options = ("remount," if size else "") + volatile.mount_options(args.tmpfs_mb)
+        result = run(f"sudo mount -t tmpfs -o {options} tmpfs {root}", check=False)
+        if result.returncode != 0:
+            root = volatile.fallback_dir()
+            if not root:
+                print(f"⚠️  Not using a tmpfs: {result.stderr.strip()}")
+                return
+            print(f"⚠️  Can't mount a tmpfs ({result.stderr.strip()}), using {root} instead (no size cap)")
+    handles["volatile_dir"] = root
+    logs = volatile.log_dir(root)
+    # Only for this run: the registry keeps the session's usual log paths
+    handles["vnc_log"] = os.path.join(logs, f"{args.session['name']}-vncserver.log")
+    handles["novnc_log"] = os.path.join(logs, f"{args.session['name']}-novnc.log")
+    print(f"✅ XDG_CACHE_HOME, browser caches and server logs are in {root}")
+
+def volatile_cache(handles, *parts):
+    """Path in the tmpfs cache directory (XDG_CACHE_HOME), or None without --tmpfs-mb"""
+    if not handles.get("volatile_dir"):
+        return None
+    return os.path.join(volatile.cache_dir(handles["volatile_dir"]), *parts)
+
+def cgroup_status():
+    usage = cgroups.list_sessions()
+    if not usage:
+        print("No desktop sessions are running in cgroups (start one with --cgroups)")
+        return
+    print(f"{'SESSION':<16}{'CGROUP':<9}{'PROCS':>6}{'WEIGHT':>8}{'CPU s':>10}{'MEM MB':>9}{'MEM MAX':>12}{'OOM':>5}")
+    for name, slices in usage.items():
+        for slice_name, entry in slices.items():
+            memory_max = entry["memory_max"] or "-"
+            if memory_max.isdigit():
+                memory_max = f"{int(memory_max) / 1e6:.0f} MB"
+            print(f"{name:<16}{slice_name:<9}{entry['processes']:>6}{entry['cpu_weight'] or '-':>8}"
+                  f"{entry['cpu_seconds']:>10.1f}{entry['memory_mb']:>9.0f}{memory_max:>12}{entry['oom_kills']:>5}")
+
+def stop_session(name):
+    registry = sessions.load_registry()
+    if name not in registry:
+        raise Exception(f"No session named '{name}' (see: desktop_toggle.py session list)")
+    session = sessions.get_session(name)
+    print(f"🛑 Stopping session '{name}' (display :{session['display']})...")
+    kill_existing(session)
+    sessions.unregister(name)
+    cgroups.remove(name)
+    print(f"✅ Session '{name}' stopped")
+
+def list_sessions():
+    registry = sessions.load_registry()
+    if not registry:
+        print("No desktop sessions registered")
+        return
+    print(f"{'NAME':<16}{'DISPLAY':<9}{'VNC':<7}{'WEB':<7}{'STATUS':<10}URL")
+    for name, session in sorted(registry.items(), key=lambda item: item[1]["display"]):
+        status = "running" if sessions.is_running(session) else "stopped"
+        print(f"{name:<16}:{session['display']:<8}{session['vnc_port']:<7}{session['web_port']:<7}"
+              f"{status:<10}{get_preview_url(web_port=session['web_port'])}")
+
+def write_run_report(args, timings, error=None):
+    """Save the phase timings and counters; never lets a reporting problem fail the run"""
+    try:
+        path = timing.write_report(
+            command=args.command or "start",
+            session=args.session["name"],
+            profile=args.profile,
+            preset=args.preset,
+            proxy=args.proxy,
+            steps={name: round(seconds, 3) for name, seconds in timings.items()},
+            ok=error is None,
+            error=error,
+        )
+        print(f"📊 Run report: {path}")
+        if args.trace:
+            print(f"📊 Trace (open in chrome://tracing or ui.perfetto.dev): {timing.write_trace()}")
+    except OSError as e:
+        print(f"⚠️  Could not write the run report: {e}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.command == "install-group":
+            install_group(args.group)
+            return
+
+        if args.command == "stats":
+            samples = collect_metrics()
+            if args.prometheus:
+                print(metrics.render_prometheus(samples), end="")
+            else:
+                print_stats(samples)
+            return
+        if args.command == "metrics-server":
+            metrics.serve(args.port, collect_metrics, args.host)
+            return
+        if args.command == "cgroup-status":
+            cgroup_status()
+            return
+        if args.command == "idle-report":
+            registry = sessions.load_registry()
+            if args.session not in registry and args.session != sessions.DEFAULT_NAME:
+                raise Exception(f"No session named '{args.session}' (see: desktop_toggle.py session list)")
+            idle_report(args.seconds, registry.get(args.session))
+            return
+        if args.command == "build-image":
+            build_image(args.profile, args.output)
+            return
+        if args.command == "session" and args.session_command == "list":
+            list_sessions()
+            return
+        if args.command == "session" and args.session_command == "stop":
+            stop_session(args.name)
+            return
+
+        name = args.name if args.command == "session" else sessions.DEFAULT_NAME
+        args.session = sessions.get_session(name)
+        args.preset = resolve_preset(args.preset)
+        start = time.monotonic()
+        handles = {}
+        try:
+            timings = scheduler.run_steps(startup_steps(args, handles), serial=args.serial)
+        except Exception as e:
+            write_run_report(args, {}, str(e))
+            raise
+        scheduler.print_timings(timings, time.monotonic() - start)
+        write_run_report(args, timings)
+        sessions.register(args.session, handles.get("vnc"), handles["novnc"].pid)
         
         print("\n" + "="*60)
         print("✅ Desktop is running!")
         print("="*60)
-        print(f"🌐 Open in browser: {get_preview_url()}")
+        if args.session["name"] != sessions.DEFAULT_NAME:
+            print(f"🖥️  Session '{args.session['name']}' on display :{args.session['display']} "
+                  f"(VNC port {args.session['vnc_port']}, web port {args.session['web_port']})")
+        print(f"🌐 Open in browser: {get_preview_url(args.preset, args.session['web_port'])}")
         print("🔐 VNC password: user123")
-        print("\n📦 Installed Applications:")
-        print("   🌐 BROWSERS:")
-        print("      • Firefox, Chromium")
-        print("   📁 FILE MANAGEMENT:")
-        print("      • Thunar File Manager, Archive Manager")
-        print("      • Supports: ZIP, 7z, TAR, GZIP, BZIP2, XZ, RAR")
-        print("   📝 OFFICE & PRODUCTIVITY:")
-        print("      • LibreOffice (Writer, Calc, Impress)")
-        print("      • PDF Viewer (Evince), Calculator")
-        print("   ✏️  TEXT EDITORS:")
-        print("      • Mousepad, Geany IDE")
-        print("   🎨 GRAPHICS & MEDIA:")
-        print("      • GIMP, Inkscape, Image Viewer")
-        print("      • VLC Media Player, Audacious Music Player")
-        print("   🔧 SYSTEM TOOLS:")
-        print("      • Task Manager, System Monitor")
-        print("      • Disk Usage Analyzer, GParted")
-        print("      • Screenshot Tools (Flameshot)")
-        print("   💻 DEVELOPMENT:")
-        print("      • Meld (diff/merge), Gitg (Git GUI)")
-        print("   🌐 NETWORK:")
-        print("      • Transmission (BitTorrent), FileZilla (FTP)")
-        print("   🍷 WINDOWS COMPATIBILITY:")
-        print("      • Wine + Winetricks (Run Windows .exe files)")
-        print("   📶 BLUETOOTH:")
-        print("      • Blueman Bluetooth Manager")
-        print("\n🖼️  Desktop icons have been created for all apps!")
+        print_installed_apps(args.profile, args.lazy)
         print("\n💡 Tips:")
         print("   • Use 'apt install <package>' to install more software")
         print("   • The desktop will NEVER disconnect or lock")
         print("   • All apps are available from the Applications menu")
         print("   • Double-click desktop icons to launch apps")
         print("="*60)
+
+        if args.command == "supervise":
+            run_supervisor(handles, args)
+        else:
+            start_log_watcher(args.session, handles)
     except Exception as e:
         print(f"\n❌ Error: {e}")
         print("💡 Try running the script again or check the logs")
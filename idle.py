@@ -0,0 +1,109 @@
+"""Freezes a desktop nobody is looking at (supervise --idle-freeze MINUTES).
+
+The supervisor calls tick() on every poll. Once neither the web port nor
+the VNC port has had a connection for the idle period, the session's apps
+are frozen: the whole apps cgroup when --cgroups is on (cgroup.freeze),
+otherwise every process on the session's display gets SIGSTOP. Xvnc and
+the proxy keep running, so a viewer that connects still gets the picture
+straight away, and the apps are thawed on the next poll.
+
+The frozen pids are recorded in a file so that stopping the desktop (or a
+crashed supervisor) never leaves processes stopped forever.
+"""
+import json
+import os
+import signal
+import time
+
+import proc_control
+import proc_stats
+
+STATE_DIR = os.path.expanduser("~/.desktop_toggle")
+
+def state_path(name):
+    return os.path.join(STATE_DIR, f"frozen-{name}.json")
+
+def make_policy(session, idle_seconds, spare_patterns=(), apps_cgroup=None):
+    return {
+        "session": session,
+        "idle_seconds": idle_seconds,
+        "spare_patterns": list(spare_patterns),
+        "apps_cgroup": apps_cgroup,
+        "last_seen": time.monotonic(),
+        "frozen": False,
+    }
+
+def viewers_connected(session):
+    counts = proc_stats.tcp_connections([session["vnc_port"], session["web_port"]])
+    return any(counts.values())
+
+def ancestors(pid):
+    """Our own parent chain (the terminal running supervise must never be stopped)"""
+    chain = set()
+    while pid > 1:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                pid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            break
+        chain.add(pid)
+    return chain
+
+def desktop_pids(policy):
+    """Processes on the session's display, minus Xvnc, the proxy and our ancestors"""
+    spared = ancestors(os.getpid())
+    display = policy["session"]["display"]
+    return [pid for pid, argv in proc_stats.session_processes(display).items()
+            if pid not in spared and not proc_control.process_matches(argv, policy["spare_patterns"])]
+
+def write_state(name, state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp_path = state_path(name) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path(name))
+
+def freeze(policy):
+    name = policy["session"]["name"]
+    if policy["apps_cgroup"]:
+        state = {"cgroup": policy["apps_cgroup"], "pids": []}
+        write_state(name, state)
+        with open(os.path.join(policy["apps_cgroup"], "cgroup.freeze"), "w") as f:
+            f.write("1")
+        what = "apps cgroup"
+    else:
+        pids = desktop_pids(policy)
+        # Record first, so a crash right after SIGSTOP can still be undone
+        write_state(name, {"cgroup": None, "pids": pids})
+        proc_control.signal_pids(pids, signal.SIGSTOP)
+        what = f"{len(pids)} processes"
+    policy["frozen"] = True
+    print(f"⏸️  No viewer for {policy['idle_seconds'] / 60:g} min, froze the desktop ({what}; Xvnc keeps running)")
+
+def thaw(name):
+    """Resume whatever was frozen for session name; safe to call when nothing is"""
+    try:
+        with open(state_path(name)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if state.get("cgroup"):
+        try:
+            with open(os.path.join(state["cgroup"], "cgroup.freeze"), "w") as f:
+                f.write("0")
+        except OSError:
+            pass
+    proc_control.signal_pids(state.get("pids", []), signal.SIGCONT)
+    proc_control.remove_file(state_path(name))
+    return True
+
+def tick(policy):
+    now = time.monotonic()
+    if viewers_connected(policy["session"]):
+        policy["last_seen"] = now
+        if policy["frozen"]:
+            thaw(policy["session"]["name"])
+            policy["frozen"] = False
+            print("▶️  Viewer connected, desktop resumed")
+    elif not policy["frozen"] and now - policy["last_seen"] >= policy["idle_seconds"]:
+        freeze(policy)
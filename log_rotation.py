@@ -0,0 +1,71 @@
+"""Keeps the Xvnc, proxy and install logs from growing without bound.
+
+The servers write their logs through descriptors opened with O_APPEND (see
+open_log), so a log can be rotated while they run: it is copied to <log>.1
+(older copies move up to .2) and truncated, and the server carries on
+writing at the new end. The supervisor checks the sizes once a minute;
+without one, desktop_toggle.py leaves this module running as a small
+detached watcher (python3 log_rotation.py --pid XVNC_PID LOG...) that does
+the same until that Xvnc exits.
+"""
+import argparse
+import os
+import shutil
+import time
+
+import proc_control
+
+MAX_BYTES = 5 * 1024 * 1024
+KEEP = 2                # rotated copies kept next to each log
+CHECK_INTERVAL = 60     # seconds between size checks in the supervisor
+PID_CHECK_INTERVAL = 5  # seconds between checks that the watcher's Xvnc still runs
+
+def open_log(path):
+    """Open a server log, emptied, in append mode so it can be rotated under the server"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644), "w")
+
+def rotate(path, max_bytes=MAX_BYTES, keep=KEEP):
+    """Rotate path if it is bigger than max_bytes; True if it was"""
+    try:
+        if os.path.getsize(path) <= max_bytes:
+            return False
+    except OSError:
+        return False
+    for n in range(keep - 1, 0, -1):
+        if os.path.exists(f"{path}.{n}"):
+            os.replace(f"{path}.{n}", f"{path}.{n + 1}")
+    shutil.copyfile(path, f"{path}.1")
+    os.truncate(path, 0)
+    return True
+
+def make_watch(paths, interval=CHECK_INTERVAL):
+    return {"paths": list(paths), "interval": interval, "last_check": time.monotonic()}
+
+def tick(watch):
+    now = time.monotonic()
+    if now - watch["last_check"] < watch["interval"]:
+        return
+    watch["last_check"] = now
+    for path in watch["paths"]:
+        if rotate(path):
+            print(f"🗂️  Rotated {path} (over {MAX_BYTES // (1024 * 1024)} MB)")
+
+def watch_until_exit(pid, paths, interval=CHECK_INTERVAL):
+    watch = make_watch(paths, interval)
+    while proc_control.pid_alive(pid):
+        tick(watch)
+        time.sleep(PID_CHECK_INTERVAL)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rotate the desktop's server logs while its Xvnc runs")
+    parser.add_argument("--pid", type=int, required=True, help="exit once this process (Xvnc) has")
+    parser.add_argument("paths", nargs="+", metavar="LOG")
+    args = parser.parse_args()
+    try:
+        watch_until_exit(args.pid, args.paths)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
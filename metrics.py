@@ -0,0 +1,138 @@
+"""Resource and traffic metrics of the running desktops.
+
+collect() samples every registered session: CPU time, resident memory and
+I/O of its Xvnc, proxy and desktop (XFCE and apps) processes from /proc,
+established connections on its VNC and web ports, the built-in proxy's byte
+counters, uptime, and the supervisor's restart counts. The samples can be
+printed as a table (`desktop_toggle.py stats`) or served in the Prometheus
+text format (`desktop_toggle.py metrics-server`).
+"""
+import http.server
+import json
+import time
+
+import proc_control
+import proc_stats
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def collect(registry, patterns_for):
+    """Sample every session in registry; patterns_for(session) gives its (Xvnc, proxy) patterns.
+
+    Returns [(metric name, {label: value}, value)].
+    """
+    samples = []
+    now = time.time()
+    ports = [port for s in registry.values() for port in (s["vnc_port"], s["web_port"])]
+    connections = proc_stats.tcp_connections(ports)
+    for name, session in registry.items():
+        xvnc, proxy = patterns_for(session)
+        roles = {"xvnc": [], "proxy": [], "desktop": []}
+        for pid, argv in proc_stats.session_processes(session["display"], [xvnc, proxy]).items():
+            if proc_control.process_matches(argv, [xvnc]):
+                roles["xvnc"].append(pid)
+            elif proc_control.process_matches(argv, [proxy]):
+                roles["proxy"].append(pid)
+            else:
+                roles["desktop"].append(pid)
+        up = bool(roles["xvnc"])
+        samples.append(("desktop_up", {"session": name}, int(up)))
+        if up and session.get("started"):
+            samples.append(("desktop_uptime_seconds", {"session": name}, round(now - session["started"], 1)))
+        for role, pids in roles.items():
+            usage = proc_stats.sample(pids).values()
+            io = [proc_stats.process_io(pid) for pid in pids]
+            labels = {"session": name, "role": role}
+            samples.append(("desktop_processes", labels, len(usage)))
+            samples.append(("desktop_cpu_seconds_total", labels, round(sum(u[1] for u in usage), 2)))
+            samples.append(("desktop_memory_rss_bytes", labels, sum(u[2] for u in usage)))
+            samples.append(("desktop_io_read_bytes_total", labels, sum(r for r, _ in io)))
+            samples.append(("desktop_io_written_bytes_total", labels, sum(w for _, w in io)))
+
+        for kind in ("vnc_port", "web_port"):
+            samples.append(("desktop_connections", {"session": name, "port": str(session[kind])},
+                            connections.get(session[kind], 0)))
+        # Viewers connect to the web port (noVNC) or straight to the VNC port;
+        # the proxy's own connections to the VNC port are not viewers
+        direct_vnc = max(connections.get(session["vnc_port"], 0) - connections.get(session["web_port"], 0), 0)
+        samples.append(("desktop_viewers", {"session": name}, connections.get(session["web_port"], 0) + direct_vnc))
+
+        totals = read_json(session.get("proxy_stats", "")).get("totals")
+        if totals:
+            samples.append(("desktop_proxy_bytes_total", {"session": name, "direction": "from_clients"},
+                            totals["bytes_from_clients"]))
+            samples.append(("desktop_proxy_bytes_total", {"session": name, "direction": "to_clients"},
+                            totals["bytes_to_clients"]))
+            samples.append(("desktop_proxy_connections_total", {"session": name}, totals["connections"]))
+            if totals.get("last_rtt_ms") is not None:
+                samples.append(("desktop_proxy_rtt_ms", {"session": name}, totals["last_rtt_ms"]))
+
+        state = read_json(session.get("supervisor_state", ""))
+        if state and proc_control.pid_alive(state.get("pid", 0)):
+            samples.append(("desktop_supervisor_uptime_seconds", {"session": name}, round(now - state["started"], 1)))
+            for component, info in state.get("components", {}).items():
+                samples.append(("desktop_restarts_total", {"session": name, "component": component},
+                                info["restarts"]))
+    return samples
+
+HELP = {
+    "desktop_up": ("gauge", "1 if the session's Xvnc is running"),
+    "desktop_uptime_seconds": ("gauge", "Seconds since the session was started"),
+    "desktop_processes": ("gauge", "Processes per role (xvnc, proxy, desktop = XFCE and apps)"),
+    "desktop_cpu_seconds_total": ("counter", "CPU time used by the role's current processes"),
+    "desktop_memory_rss_bytes": ("gauge", "Resident memory of the role's processes"),
+    "desktop_io_read_bytes_total": ("counter", "Bytes read by the role's processes (files and sockets)"),
+    "desktop_io_written_bytes_total": ("counter", "Bytes written by the role's processes (files and sockets)"),
+    "desktop_connections": ("gauge", "Established TCP connections on the port"),
+    "desktop_viewers": ("gauge", "Connected viewers (noVNC plus direct VNC clients)"),
+    "desktop_proxy_bytes_total": ("counter", "WebSocket payload bytes through the built-in proxy"),
+    "desktop_proxy_connections_total": ("counter", "Connections accepted by the built-in proxy"),
+    "desktop_proxy_rtt_ms": ("gauge", "Last round-trip time to a viewer measured by the built-in proxy"),
+    "desktop_supervisor_uptime_seconds": ("gauge", "Seconds since the supervisor started"),
+    "desktop_restarts_total": ("counter", "Restarts of a supervised component"),
+}
+
+def render_prometheus(samples):
+    # All samples of a metric have to be listed together, under its HELP/TYPE lines
+    families = {}
+    for name, labels, value in samples:
+        families.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, family in families.items():
+        metric_type, help_text = HELP.get(name, ("untyped", name))
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for labels, value in family:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def serve(port, collect_samples, host="127.0.0.1"):
+    """Serve GET /metrics until interrupted; samples are collected fresh on every scrape"""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus(collect_samples()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    print(f"📈 Serving metrics on http://{host}:{port}/metrics (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
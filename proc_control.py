@@ -0,0 +1,206 @@
+"""Process control shared by desktop_toggle.py, delete_desktop.py and start_desktop.py.
+
+Process lookups read /proc directly, signals go through os.kill and file
+operations are plain syscalls, so killing a handful of processes or removing
+lock files doesn't fork a shell (and a pkill/rm/chmod) for every step.
+"""
+import glob
+import os
+import re
+import shutil
+import signal
+import time
+
+def iter_processes():
+    """Yield (pid, argv list) for every process we can see, in a single /proc scan"""
+    own_pid = os.getpid()
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        pid = int(entry.name)
+        if pid == own_pid:
+            continue
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                raw = f.read()
+        except OSError:
+            continue  # exited while we were scanning, or not ours to read
+        if not raw:
+            continue  # kernel thread or zombie
+        yield pid, [arg.decode(errors="replace") for arg in raw.rstrip(b"\0").split(b"\0")]
+
+def process_matches(argv, patterns=(), names=()):
+    """Match like `pkill -f pattern` (regex on the full command line) or `pkill name`"""
+    if names and os.path.basename(argv[0]) in names:
+        return True
+    cmdline = " ".join(argv)
+    return any(re.search(pattern, cmdline) for pattern in patterns)
+
+def xvnc_pattern(display):
+    """Matches the Xvnc (or Xtightvnc) of display, never that of :10 when display is 1"""
+    return rf"X(vnc|tightvnc).*:{display}\b"
+
+def proxy_pattern(web_port):
+    """Matches websockify or the built-in ws_proxy.py listening on web_port"""
+    return rf"(websockify|ws_proxy\.py).* {web_port} "
+
+def find_pids(patterns=(), names=()):
+    """Return the pids of all processes matching any pattern or name"""
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    return [pid for pid, argv in iter_processes() if process_matches(argv, patterns, names)]
+
+def signal_pids(pids, sig=signal.SIGTERM):
+    """Send sig to each pid, returning the ones that were actually signalled"""
+    signalled = []
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+            signalled.append(pid)
+        except (ProcessLookupError, PermissionError):
+            pass
+    return signalled
+
+def kill_matching(patterns=(), names=(), sig=signal.SIGTERM):
+    """pkill replacement: one /proc scan, then os.kill for every match"""
+    return signal_pids(find_pids(patterns, names), sig)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # A zombie still has a pid but is already dead
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return False
+
+def socket_inodes_on_ports(ports):
+    """{socket inode: port} for TCP sockets (IPv4 and IPv6) whose local port is in ports"""
+    ports = set(ports)
+    inodes = {}
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)  # header
+                for line in f:
+                    fields = line.split()
+                    port = int(fields[1].rsplit(":", 1)[1], 16)
+                    if port in ports and fields[9] != "0":
+                        inodes[fields[9]] = port
+        except (OSError, StopIteration):
+            continue
+    return inodes
+
+def pids_on_ports(ports):
+    """fuser replacement for several ports in one /proc scan: {port: [pids]}"""
+    inodes = {f"socket:[{inode}]": port for inode, port in socket_inodes_on_ports(ports).items()}
+    result = {port: [] for port in ports}
+    if not inodes:
+        return result
+    own_pid = str(os.getpid())
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit() or entry.name == own_pid:
+            continue
+        try:
+            fds = os.scandir(f"/proc/{entry.name}/fd")
+        except OSError:
+            continue
+        with fds:
+            for fd in fds:
+                try:
+                    port = inodes.get(os.readlink(fd.path))
+                except OSError:
+                    continue
+                if port is not None and int(entry.name) not in result[port]:
+                    result[port].append(int(entry.name))
+    return result
+
+def terminate(pids, timeout=5):
+    """Stop processes the polite way first: SIGTERM all of them at once, wait
+    until they exit or the deadline passes, then SIGKILL the rest.
+
+    Returns (exited after SIGTERM, killed with SIGKILL, still alive) pid lists.
+    """
+    signalled = signal_pids(set(pids), signal.SIGTERM)
+    pending = signalled
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while pending and time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.1)
+        pending = [pid for pid in pending if pid_alive(pid)]
+    exited = [pid for pid in signalled if pid not in pending]
+    killed = signal_pids(pending, signal.SIGKILL)
+    # SIGKILL can't be ignored, but the kernel still needs a moment to reap
+    deadline = time.monotonic() + 1
+    while killed and time.monotonic() < deadline and any(pid_alive(pid) for pid in killed):
+        time.sleep(0.01)
+    survivors = [pid for pid in pending if pid_alive(pid)]
+    return exited, [pid for pid in killed if pid not in survivors], survivors
+
+def process_name(pid):
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            return f.read().strip()
+    except OSError:
+        return "?"
+
+def remove_display_files(display):
+    """Remove vncserver's pid file and the X lock/socket left behind by a dead server"""
+    for pid_file in glob.glob(os.path.expanduser(f"~/.vnc/*:{display}.pid")):
+        remove_file(pid_file)
+    remove_file(f"/tmp/.X{display}-lock")
+    remove_file(f"/tmp/.X11-unix/X{display}")
+
+def remove_file(path):
+    """rm -f replacement"""
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+# PATH index: executable name -> candidate paths in PATH order, built with one
+# scandir per PATH directory instead of a stat per directory on every lookup
+path_index = None
+path_index_key = None
+
+def build_path_index(path):
+    index = {}
+    for directory in path.split(os.pathsep):
+        if not directory:
+            continue
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                index.setdefault(entry.name, []).append(entry.path)
+    return index
+
+def invalidate_path_index():
+    """Forget the PATH index, e.g. after installing packages"""
+    global path_index
+    path_index = None
+
+def which(name):
+    """shutil.which replacement backed by the PATH index"""
+    global path_index, path_index_key
+    if os.sep in name:
+        return shutil.which(name)
+    path = os.environ.get("PATH", os.defpath)
+    index = path_index
+    if index is None or path_index_key != path:
+        index = build_path_index(path)
+        path_index, path_index_key = index, path
+    for candidate in index.get(name, ()):
+        # Only the few names looked up pay for the executable check
+        if os.access(candidate, os.X_OK) and not os.path.isdir(candidate):
+            return candidate
+    return None
@@ -0,0 +1,113 @@
+"""CPU and memory usage of a desktop session, read straight from /proc.
+
+A session's processes are its Xvnc and proxy (matched by command line) plus
+every process whose environment has DISPLAY set to the session's display:
+the XFCE session, its panels and daemons and every app started from it.
+"""
+import os
+import time
+
+import proc_control
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def read_environ(pid):
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            raw = f.read()
+    except OSError:
+        return {}
+    env = {}
+    for item in raw.split(b"\0"):
+        key, sep, value = item.partition(b"=")
+        if sep:
+            env[key.decode(errors="replace")] = value.decode(errors="replace")
+    return env
+
+def session_processes(display, patterns=()):
+    """{pid: argv} of the processes that belong to the desktop on display"""
+    processes = {}
+    for pid, argv in proc_control.iter_processes():
+        if proc_control.process_matches(argv, patterns):
+            processes[pid] = argv
+        elif read_environ(pid).get("DISPLAY", "").split(".")[0] == f":{display}":
+            processes[pid] = argv
+    return processes
+
+def session_pids(display, patterns=()):
+    """Pids of the processes that belong to the desktop on display"""
+    return sorted(session_processes(display, patterns))
+
+def process_usage(pid):
+    """(name, CPU seconds used so far, resident memory in bytes), or None if it's gone"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    name = stat[stat.index("(") + 1:stat.rindex(")")]
+    fields = stat[stat.rindex(")") + 2:].split()
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat (1-based, counting pid and comm)
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return name, cpu_seconds, resident_pages * PAGE_SIZE
+
+def sample(pids):
+    usage = {}
+    for pid in pids:
+        result = process_usage(pid)
+        if result:
+            usage[pid] = result
+    return usage
+
+def measure(display, patterns=(), seconds=30):
+    """Average CPU use and current memory per process name over seconds of idling.
+
+    Returns {name: {"processes": n, "cpu_percent": %, "rss_mb": MB}}.
+    """
+    pids = session_pids(display, patterns)
+    before = sample(pids)
+    start = time.monotonic()
+    time.sleep(seconds)
+    elapsed = time.monotonic() - start
+    after = sample(pids)
+
+    by_name = {}
+    for pid, (name, cpu_seconds, rss) in after.items():
+        if pid not in before:
+            continue
+        entry = by_name.setdefault(name, {"processes": 0, "cpu_percent": 0.0, "rss_mb": 0.0})
+        entry["processes"] += 1
+        entry["cpu_percent"] += (cpu_seconds - before[pid][1]) / elapsed * 100
+        entry["rss_mb"] += rss / 1e6
+    for entry in by_name.values():
+        entry["cpu_percent"] = round(entry["cpu_percent"], 2)
+        entry["rss_mb"] = round(entry["rss_mb"], 1)
+    return by_name
+
+def process_io(pid):
+    """(bytes read, bytes written) by the process through any file descriptor, sockets included"""
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def tcp_connections(ports):
+    """{port: number of established TCP connections whose local port it is}"""
+    counts = {port: 0 for port in ports}
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)  # header
+                for line in f:
+                    fields = line.split()
+                    port = int(fields[1].rsplit(":", 1)[1], 16)
+                    if port in counts and fields[3] == "01":   # 01 = ESTABLISHED
+                        counts[port] += 1
+        except (OSError, StopIteration):
+            continue
+    return counts
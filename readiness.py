@@ -0,0 +1,78 @@
+"""Readiness checks for the VNC server and the noVNC web interface.
+
+Instead of sleeping for a fixed time, these poll for the real signal (the X
+socket appearing, a port accepting connections, an RFB or HTTP reply) with a
+short exponential backoff and an overall deadline. If the process being
+waited on exits with an error, the wait fails straight away.
+"""
+import os
+import socket
+import time
+
+X11_SOCKET_DIR = "/tmp/.X11-unix"
+
+def wait_until(check, what, timeout=30, proc=None, exit_ok=False):
+    """Poll check() until it returns True, returning the seconds waited.
+
+    proc is an optional subprocess.Popen for the server being started. If it
+    exits before check() passes the wait fails immediately, unless exit_ok is
+    set and it exited cleanly (e.g. vncserver, which forks Xvnc and returns).
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    delay = 0.01
+    while True:
+        if check():
+            return time.monotonic() - start
+        if proc is not None and proc.poll() is not None:
+            if proc.returncode != 0 or not exit_ok:
+                raise Exception(f"{what}: process exited with code {proc.returncode}")
+        now = time.monotonic()
+        if now >= deadline:
+            raise Exception(f"{what} not ready after {timeout:.0f}s")
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, 0.5)
+
+def x_socket_path(display):
+    return os.path.join(X11_SOCKET_DIR, f"X{display}")
+
+def port_open(port, host="localhost", timeout=0.5):
+    """True if something accepts TCP connections on host:port"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def probe_rfb(port, host="localhost", timeout=1.0):
+    """True if the server on port answers with an RFB protocol version banner"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            banner = sock.recv(12)
+            return banner.startswith(b"RFB ")
+    except OSError:
+        return False
+
+def probe_http(port, host="localhost", path="/", timeout=1.0):
+    """True if the server on port answers an HTTP request (any status code)"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(f"GET {path} HTTP/1.0\r\nHost: {host}\r\n\r\n".encode())
+            return sock.recv(16).startswith(b"HTTP/1.")
+    except OSError:
+        return False
+
+def wait_for_vnc(display, port, timeout=30, proc=None):
+    """Wait for Xvnc's X socket and for a real RFB handshake on its VNC port"""
+    waited = wait_until(lambda: os.path.exists(x_socket_path(display)),
+                        f"X socket for display :{display}", timeout, proc, exit_ok=True)
+    return waited + wait_until(lambda: probe_rfb(port), f"VNC server on port {port}",
+                               max(timeout - waited, 1), proc, exit_ok=True)
+
+def wait_for_http(port, timeout=30, proc=None):
+    """Wait until the web server on port answers HTTP requests"""
+    return wait_until(lambda: probe_http(port), f"web server on port {port}", timeout, proc)
+
+def wait_for_port_free(port, timeout=5):
+    """Wait until nothing is listening on port any more"""
+    return wait_until(lambda: not port_open(port), f"port {port} to close", timeout)
@@ -0,0 +1,57 @@
+"""Tiny dependency-graph scheduler for the desktop startup steps.
+
+Steps are (name, func, [names of steps it depends on]). Every step starts as
+soon as all of its dependencies have finished, so independent steps overlap
+on a thread pool. With serial=True the steps simply run in the order given,
+which is handy for debugging.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import timing
+
+def timed(name, func):
+    start = time.monotonic()
+    with timing.phase(name):
+        func()
+    return time.monotonic() - start
+
+def run_steps(steps, serial=False, max_workers=4):
+    """Run the steps and return {step name: seconds taken}"""
+    names = [name for name, _, _ in steps]
+    for name, _, deps in steps:
+        for dep in deps:
+            if dep not in names:
+                raise Exception(f"Step '{name}' depends on unknown step '{dep}'")
+
+    timings = {}
+    if serial:
+        for name, func, _ in steps:
+            timings[name] = timed(name, func)
+        return timings
+
+    pending = {name: (func, set(deps)) for name, func, deps in steps}
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name, (func, deps) in list(pending.items()):
+                if deps <= done:
+                    running[pool.submit(timed, name, func)] = name
+                    del pending[name]
+            if not running:
+                raise Exception(f"Dependency cycle between steps: {', '.join(pending)}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # Re-raises the step's exception; steps already running are
+                # allowed to finish, steps not started yet are dropped
+                timings[name] = future.result()
+                done.add(name)
+    return timings
+
+def print_timings(timings, total):
+    print("\n⏱️  Startup timings:")
+    for name, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+        print(f"   {seconds:7.2f}s  {name}")
+    print(f"   {total:7.2f}s  total wall time ({sum(timings.values()):.2f}s of step time)")
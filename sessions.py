@@ -0,0 +1,114 @@
+"""Registry of desktop sessions, so several isolated desktops can share one host.
+
+A session is a dict with its name, X display number, VNC port, web (noVNC)
+port, state directory (passwd, xstartup, config, logs) and the pids of its
+Xvnc and proxy processes. The default session keeps the classic layout:
+display :1, ports 5901/6080 and ~/.vnc. Extra sessions get the next free
+display N, VNC port 5900+N, web port 6079+N and ~/.desktop_toggle/sessions/<name>.
+"""
+import json
+import os
+import socket
+import time
+
+import proc_control
+
+STATE_DIR = os.path.expanduser("~/.desktop_toggle")
+REGISTRY_PATH = os.path.join(STATE_DIR, "sessions.json")
+SESSIONS_DIR = os.path.join(STATE_DIR, "sessions")
+DEFAULT_NAME = "default"
+MAX_DISPLAY = 64
+
+def make_session(name, display):
+    if name == DEFAULT_NAME:
+        state_dir = os.path.expanduser("~/.vnc")
+        vnc_log = "/tmp/vncserver.log"
+        novnc_log = os.path.expanduser("~/.novnc.log")
+        proxy_stats = os.path.join(STATE_DIR, "proxy_stats.json")
+        supervisor_state = os.path.join(STATE_DIR, "supervisor.json")
+    else:
+        state_dir = os.path.join(SESSIONS_DIR, name)
+        vnc_log = os.path.join(state_dir, "vncserver.log")
+        novnc_log = os.path.join(state_dir, "novnc.log")
+        proxy_stats = os.path.join(state_dir, "proxy_stats.json")
+        supervisor_state = os.path.join(state_dir, "supervisor.json")
+    return {
+        "name": name,
+        "display": display,
+        "vnc_port": 5900 + display,
+        "web_port": 6079 + display,
+        "state_dir": state_dir,
+        "vnc_log": vnc_log,
+        "novnc_log": novnc_log,
+        "proxy_stats": proxy_stats,
+        "supervisor_state": supervisor_state,
+        "xvnc_pid": None,
+        "proxy_pid": None,
+        "started": None,
+    }
+
+def default_session():
+    return make_session(DEFAULT_NAME, 1)
+
+def load_registry():
+    try:
+        with open(REGISTRY_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_registry(registry):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp_path = REGISTRY_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp_path, REGISTRY_PATH)
+
+def register(session, xvnc_pid=None, proxy_pid=None, started=None):
+    registry = load_registry()
+    session = dict(session, xvnc_pid=xvnc_pid, proxy_pid=proxy_pid, started=started or time.time())
+    registry[session["name"]] = session
+    save_registry(registry)
+    return session
+
+def unregister(name):
+    registry = load_registry()
+    registry.pop(name, None)
+    save_registry(registry)
+
+def is_running(session):
+    return bool(session.get("xvnc_pid")) and proc_control.pid_alive(session["xvnc_pid"])
+
+def port_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("", port))
+            return True
+        except OSError:
+            return False
+
+def display_free(display, registry):
+    for session in registry.values():
+        if session["display"] == display and is_running(session):
+            return False
+    if os.path.exists(f"/tmp/.X{display}-lock") or os.path.exists(f"/tmp/.X11-unix/X{display}"):
+        return False
+    candidate = make_session("probe", display)
+    return port_free(candidate["vnc_port"]) and port_free(candidate["web_port"])
+
+def get_session(name):
+    """The registered session called name, or a newly allocated one"""
+    registry = load_registry()
+    if name in registry:
+        # Paths are derived again rather than trusted from an older run's entry
+        saved = registry[name]
+        session = make_session(name, saved["display"])
+        session.update({key: saved.get(key) for key in ("xvnc_pid", "proxy_pid", "started")})
+        return session
+    if name == DEFAULT_NAME:
+        return default_session()
+    # Display :1 is reserved for the default session
+    for display in range(2, MAX_DISPLAY):
+        if display_free(display, registry):
+            return make_session(name, display)
+    raise Exception(f"No free display between :2 and :{MAX_DISPLAY - 1}")
@@ -0,0 +1,131 @@
+"""Keeps the desktop's server processes running.
+
+Each component is a dict built by make_component() with a start() function
+returning a handle (a Popen or a pid) and an is_alive(handle) check. The
+supervisor polls every component a couple of times per second and restarts
+only the one that died. A component that keeps crashing is restarted with an
+exponentially growing delay (crash-loop backoff) instead of in a tight loop.
+"""
+import json
+import os
+import signal
+import time
+
+import proc_control
+
+POLL_INTERVAL = 0.5
+BACKOFF_WINDOW = 60     # failures older than this no longer count towards backoff
+MAX_BACKOFF = 30
+
+def make_component(name, start, is_alive, handle=None):
+    return {
+        "name": name,
+        "start": start,
+        "is_alive": is_alive,
+        "handle": handle,
+        "restarts": 0,
+        "failures": [],
+        "next_start": 0,
+    }
+
+def backoff_delay(failures):
+    """No delay for the first failure in the window, then 1s, 2s, 4s... up to MAX_BACKOFF"""
+    if len(failures) <= 1:
+        return 0
+    return min(2 ** (len(failures) - 2), MAX_BACKOFF)
+
+def write_state(state_path, components, started):
+    if not state_path:
+        return
+    state = {
+        "pid": os.getpid(),
+        "started": started,
+        "updated": time.time(),
+        "components": {
+            c["name"]: {"restarts": c["restarts"], "alive": c["handle"] is not None}
+            for c in components
+        },
+    }
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+def check_component(component, now):
+    """Restart the component if it died; returns True if its state changed"""
+    if component["handle"] is not None and component["is_alive"](component["handle"]):
+        return False
+
+    if component["handle"] is not None:
+        # Just noticed the failure
+        component["handle"] = None
+        component["failures"] = [t for t in component["failures"] if now - t < BACKOFF_WINDOW] + [now]
+        delay = backoff_delay(component["failures"])
+        component["next_start"] = now + delay
+        if delay:
+            print(f"💥 {component['name']} died ({len(component['failures'])} times in the last "
+                  f"{BACKOFF_WINDOW}s), restarting in {delay}s")
+        else:
+            print(f"💥 {component['name']} died, restarting")
+
+    if now < component["next_start"]:
+        return True
+    try:
+        handle = component["start"]()
+        if handle is None:
+            # Counts as a failed start, so backoff applies instead of a restart every poll
+            raise Exception("it didn't come up")
+        component["handle"] = handle
+        component["restarts"] += 1
+        print(f"🔁 {component['name']} restarted (restart #{component['restarts']})")
+    except Exception as e:
+        print(f"❌ Restarting {component['name']} failed: {e}")
+        component["failures"] = [t for t in component["failures"] if now - t < BACKOFF_WINDOW] + [now]
+        component["next_start"] = now + max(backoff_delay(component["failures"]), 1)
+    return True
+
+def running_pid(state_path):
+    """Pid of the supervisor that owns state_path, if it is still running (and isn't us)"""
+    try:
+        with open(state_path) as f:
+            pid = json.load(f).get("pid")
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            # The state file outlives its supervisor, so the pid may have been reused since
+            if b"supervise" not in f.read():
+                return None
+    except (OSError, ValueError, TypeError, AttributeError):
+        return None
+    return pid if pid != os.getpid() and proc_control.pid_alive(pid) else None
+
+def stop(state_path, timeout=5):
+    """Stop the session's supervisor so it can't restart the servers being stopped; its pid or None"""
+    pid = running_pid(state_path)
+    if pid:
+        proc_control.terminate([pid], timeout)
+    return pid
+
+def supervise(components, state_path=None, on_tick=None):
+    """Watch the components until interrupted (Ctrl+C or SIGTERM).
+
+    on_tick is called on every poll, so other periodic housekeeping can share
+    this loop. The supervised processes are left running when it exits.
+    """
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    started = time.time()
+    write_state(state_path, components, started)
+    print(f"👀 Supervising {', '.join(c['name'] for c in components)} (Ctrl+C to stop watching)")
+    try:
+        while not stopping:
+            now = time.monotonic()
+            changed = False
+            for component in components:
+                changed = check_component(component, now) or changed
+            if changed:
+                write_state(state_path, components, started)
+            if on_tick:
+                on_tick()
+            time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    print("\n👋 Supervisor stopped, desktop processes left running")
@@ -0,0 +1,90 @@
+"""Startup phase timing and the machine-readable run report.
+
+Code wraps the interesting parts of a run in `with timing.phase(name):` and
+bumps the counters (subprocesses spawned, bytes downloaded by apt). At the end
+write_report() saves everything as JSON, and write_trace() saves the phases in
+Chrome's trace-event format (open it in chrome://tracing or ui.perfetto.dev).
+Recording is thread-safe because the startup steps run on a thread pool.
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+REPORT_PATH = os.path.expanduser("~/.desktop_toggle_report.json")
+TRACE_PATH = os.path.expanduser("~/.desktop_toggle_trace.json")
+
+FETCHED_LINE = re.compile(r"^Fetched ([\d.,]+) ([kMG]?B) in ")
+UNITS = {"B": 1, "kB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3}
+
+lock = threading.Lock()
+run_started = time.time()
+phases = []
+counters = {"subprocesses": 0, "apt_bytes_downloaded": 0}
+
+@contextmanager
+def phase(name, category="step"):
+    start = time.time()
+    try:
+        yield
+    finally:
+        end = time.time()
+        with lock:
+            phases.append({"name": name, "category": category, "start": start, "end": end,
+                           "thread": threading.get_ident()})
+
+def count_subprocess(n=1):
+    with lock:
+        counters["subprocesses"] += n
+
+def add_downloaded_bytes(n):
+    with lock:
+        counters["apt_bytes_downloaded"] += n
+
+def parse_apt_output_line(line):
+    """Pick up apt's "Fetched 12.3 MB in 4s" summary lines"""
+    match = FETCHED_LINE.match(line)
+    if match:
+        amount = float(match.group(1).replace(",", ""))
+        add_downloaded_bytes(int(amount * UNITS[match.group(2)]))
+
+def build_report(**extra):
+    with lock:
+        report = {
+            "started": run_started,
+            "total_seconds": round(time.time() - run_started, 3),
+            "subprocesses": counters["subprocesses"],
+            "apt_bytes_downloaded": counters["apt_bytes_downloaded"],
+            "phases": [
+                {"name": p["name"], "category": p["category"],
+                 "start_offset": round(p["start"] - run_started, 3),
+                 "seconds": round(p["end"] - p["start"], 3)}
+                for p in sorted(phases, key=lambda p: p["start"])
+            ],
+        }
+    report.update(extra)
+    return report
+
+def write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def write_report(path=REPORT_PATH, **extra):
+    write_json(path, build_report(**extra))
+    return path
+
+def write_trace(path=TRACE_PATH):
+    """Chrome trace-event format: one complete ("X") event per phase, one row per thread"""
+    pid = os.getpid()
+    with lock:
+        events = [
+            {"name": p["name"], "cat": p["category"], "ph": "X", "pid": pid, "tid": p["thread"],
+             "ts": int((p["start"] - run_started) * 1e6), "dur": int((p["end"] - p["start"]) * 1e6)}
+            for p in phases
+        ]
+    write_json(path, {"traceEvents": events, "displayTimeUnit": "ms"})
+    return path
@@ -0,0 +1,46 @@
+"""Size-capped tmpfs for the desktop's disposable files (--tmpfs-mb).
+
+Browser and thumbnail caches, XFCE's saved session state (everything under
+XDG_CACHE_HOME) and the Xvnc/proxy logs are rewritten all the time and worth
+nothing after a restart. On a Codespace's network-backed disk those writes
+stall the apps making them, so with --tmpfs-mb they go to a tmpfs mounted at
+~/.desktop_toggle/volatile instead. Settings, the apt cache and the user's
+own files stay on disk.
+
+Mounting needs sudo; without it the files go to a directory in /dev/shm,
+which is in RAM as well but has no size cap of its own.
+"""
+import os
+
+STATE_DIR = os.path.expanduser("~/.desktop_toggle")
+MOUNT_POINT = os.path.join(STATE_DIR, "volatile")
+FALLBACK_DIR = f"/dev/shm/desktop-toggle-{os.environ.get('USER', 'root')}"
+
+def tmpfs_size(path=MOUNT_POINT):
+    """Size in MB of the tmpfs mounted at path, or None if there is none"""
+    try:
+        with open("/proc/self/mounts") as f:
+            mounted = any(fields[1] == path and fields[2] == "tmpfs"
+                          for fields in (line.split() for line in f))
+    except OSError:
+        return None
+    if not mounted:
+        return None
+    stat = os.statvfs(path)
+    return stat.f_blocks * stat.f_frsize // (1024 * 1024)
+
+def mount_options(size_mb):
+    return f"size={size_mb}m,mode=0700,uid={os.getuid()},gid={os.getgid()}"
+
+def fallback_dir():
+    """Uncapped RAM-backed directory for when the tmpfs can't be mounted, or None"""
+    if not os.path.isdir("/dev/shm"):
+        return None
+    os.makedirs(FALLBACK_DIR, mode=0o700, exist_ok=True)
+    return FALLBACK_DIR
+
+def cache_dir(root):
+    return os.path.join(root, "cache")
+
+def log_dir(root):
+    return os.path.join(root, "logs")
@@ -0,0 +1,327 @@
+"""Built-in WebSocket to VNC (TCP) proxy, an alternative to the external websockify.
+
+Serves the noVNC static files over HTTP and bridges every WebSocket
+connection to the VNC server. Both directions use raw non-blocking sockets
+through asyncio's sock_* APIs: server->browser data is received straight into
+a per-connection buffer and sent from a memoryview of it, without copying.
+Any number of viewers can be connected at once.
+
+Per-connection byte counters and the WebSocket ping round-trip time are
+served as JSON on /__stats and, with --stats-file, written to disk every few
+seconds. /__stats lists the viewers' addresses, so it only answers requests
+made on this machine (not through a port forward).
+
+Usage: python3 ws_proxy.py [--web DIR] [--stats-file PATH] LISTEN_PORT HOST:PORT
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import ipaddress
+import json
+import mimetypes
+import os
+import socket
+import struct
+import time
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+BUFFER_SIZE = 256 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+PING_INTERVAL = 5
+STATS_INTERVAL = 5
+
+OP_CONTINUATION, OP_TEXT, OP_BINARY = 0x0, 0x1, 0x2
+OP_CLOSE, OP_PING, OP_PONG = 0x8, 0x9, 0xA
+MAX_CONTROL_PAYLOAD = 125       # RFC 6455 5.5
+CLOSE_PROTOCOL_ERROR = 1002
+
+connections = {}
+totals = {"connections": 0, "bytes_from_clients": 0, "bytes_to_clients": 0, "last_rtt_ms": None}
+next_connection_id = 0
+
+def unmask(payload, mask):
+    """XOR a client frame payload with its 4-byte mask (one big-int operation)"""
+    n = len(payload)
+    if not n:
+        return b""
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "little") ^ int.from_bytes(key, "little")).to_bytes(n, "little")
+
+def frame_header(opcode, length):
+    """Header for an unmasked server->client frame"""
+    if length < 126:
+        return struct.pack("!BB", 0x80 | opcode, length)
+    if length < 65536:
+        return struct.pack("!BBH", 0x80 | opcode, 126, length)
+    return struct.pack("!BBQ", 0x80 | opcode, 127, length)
+
+async def recv_exactly(loop, sock, view):
+    """Fill the whole memoryview from sock, raising ConnectionError on EOF"""
+    received = 0
+    while received < len(view):
+        n = await loop.sock_recv_into(sock, view[received:])
+        if n == 0:
+            raise ConnectionError("connection closed")
+        received += n
+
+async def read_http_request(loop, sock):
+    """Read the request line and headers; returns (method, path, {header: value})"""
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = await loop.sock_recv(sock, 4096)
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+        if len(data) > MAX_HEADER_SIZE:
+            raise ConnectionError("request headers too large")
+    head = data.split(b"\r\n\r\n", 1)[0].decode("latin-1")
+    lines = head.split("\r\n")
+    method, path, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, path, headers
+
+async def send_http(loop, sock, status, body=b"", content_type="text/plain", extra_headers=()):
+    lines = [f"HTTP/1.1 {status}", f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}", "Connection: close"] + list(extra_headers)
+    await loop.sock_sendall(sock, ("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+
+def stats_snapshot():
+    now = time.time()
+    return {
+        "time": now,
+        "totals": dict(totals, active=len(connections)),
+        "connections": [dict(c, duration=round(now - c["connected_at"], 1)) for c in connections.values()],
+    }
+
+def is_local(peer, headers):
+    """True for a request made on this machine rather than relayed by a proxy or port forward"""
+    if "x-forwarded-for" in headers or "forwarded" in headers:
+        return False
+    try:
+        address = ipaddress.ip_address(peer[0].split("%", 1)[0])
+    except ValueError:
+        return False
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_loopback
+
+async def serve_static(loop, sock, method, path, web_dir, local=False):
+    path = path.split("?", 1)[0]
+    if path == "/__stats":
+        if not local:
+            await send_http(loop, sock, "403 Forbidden", b"Stats are only served to localhost\n")
+            return
+        await send_http(loop, sock, "200 OK", json.dumps(stats_snapshot()).encode(), "application/json")
+        return
+    if not web_dir:
+        await send_http(loop, sock, "405 Method Not Allowed", b"WebSocket connections only\n")
+        return
+    if method not in ("GET", "HEAD"):
+        await send_http(loop, sock, "405 Method Not Allowed")
+        return
+    relative = os.path.normpath(path.lstrip("/")) if path != "/" else "vnc.html"
+    file_path = os.path.join(web_dir, relative)
+    if relative.startswith("..") or not os.path.isfile(file_path):
+        await send_http(loop, sock, "404 Not Found", b"Not found\n")
+        return
+    content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    size = os.path.getsize(file_path)
+    header = (f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {size}\r\n"
+              "Connection: close\r\n\r\n")
+    await loop.sock_sendall(sock, header.encode())
+    if method == "GET":
+        with open(file_path, "rb") as f:
+            await loop.sock_sendfile(sock, f)
+
+async def send_frame(loop, client, send_lock, opcode, payload=b""):
+    """Send one frame; the lock keeps frames from different tasks from interleaving"""
+    async with send_lock:
+        await loop.sock_sendall(client, frame_header(opcode, len(payload)))
+        if payload:
+            await loop.sock_sendall(client, payload)
+
+async def client_to_vnc(loop, client, vnc, stats, send_lock):
+    """Decode WebSocket frames from the browser and forward their payload to VNC"""
+    header = memoryview(bytearray(14))
+    buffer = bytearray(BUFFER_SIZE)
+    while True:
+        await recv_exactly(loop, client, header[:2])
+        first, second = header[0], header[1]
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            await recv_exactly(loop, client, header[2:4])
+            length = struct.unpack("!H", header[2:4])[0]
+        elif length == 127:
+            await recv_exactly(loop, client, header[2:10])
+            length = struct.unpack("!Q", header[2:10])[0]
+        mask = b""
+        if second & 0x80:
+            await recv_exactly(loop, client, header[10:14])
+            mask = bytes(header[10:14])
+
+        if opcode in (OP_BINARY, OP_CONTINUATION):
+            # Streamed through the fixed buffer, whatever length the client
+            # announces. BUFFER_SIZE is a multiple of 4, so every chunk starts
+            # at the beginning of the mask.
+            remaining = length
+            while remaining:
+                payload = memoryview(buffer)[:min(remaining, len(buffer))]
+                await recv_exactly(loop, client, payload)
+                await loop.sock_sendall(vnc, unmask(payload, mask) if mask else payload)
+                remaining -= len(payload)
+            stats["bytes_from_client"] += length
+            totals["bytes_from_clients"] += length
+            continue
+        if opcode not in (OP_PING, OP_PONG, OP_CLOSE):
+            raise ConnectionError("text frames are not supported, use binary mode")
+        if length > MAX_CONTROL_PAYLOAD:
+            await send_frame(loop, client, send_lock, OP_CLOSE, struct.pack("!H", CLOSE_PROTOCOL_ERROR))
+            return
+        payload = memoryview(buffer)[:length]
+        await recv_exactly(loop, client, payload)
+        data = unmask(payload, mask) if mask else payload
+
+        if opcode == OP_PING:
+            await send_frame(loop, client, send_lock, OP_PONG, bytes(data))
+        elif opcode == OP_PONG:
+            try:
+                sent = struct.unpack("!d", bytes(data))[0]
+                stats["rtt_ms"] = round((time.monotonic() - sent) * 1000, 2)
+                totals["last_rtt_ms"] = stats["rtt_ms"]
+            except struct.error:
+                pass
+        else:
+            await send_frame(loop, client, send_lock, OP_CLOSE)
+            return
+
+async def vnc_to_client(loop, vnc, client, stats, send_lock):
+    """Forward VNC data to the browser as binary frames, sending straight from the receive buffer"""
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        n = await loop.sock_recv_into(vnc, view)
+        if n == 0:
+            await send_frame(loop, client, send_lock, OP_CLOSE)
+            return
+        await send_frame(loop, client, send_lock, OP_BINARY, view[:n])
+        stats["bytes_to_client"] += n
+        totals["bytes_to_clients"] += n
+
+async def keepalive(loop, client, send_lock):
+    """Ping the browser regularly; the pong carries our timestamp back for the RTT"""
+    while True:
+        await asyncio.sleep(PING_INTERVAL)
+        await send_frame(loop, client, send_lock, OP_PING, struct.pack("!d", time.monotonic()))
+
+async def handle_websocket(loop, client, headers, peer, target):
+    global next_connection_id
+    accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WS_GUID).encode()).digest()).decode()
+    response = ["HTTP/1.1 101 Switching Protocols", "Upgrade: websocket", "Connection: Upgrade",
+                f"Sec-WebSocket-Accept: {accept}"]
+    protocols = [p.strip() for p in headers.get("sec-websocket-protocol", "").split(",")]
+    if "binary" in protocols:
+        response.append("Sec-WebSocket-Protocol: binary")
+
+    vnc = None
+    try:
+        family, _, _, _, address = (await loop.getaddrinfo(target[0], target[1], type=socket.SOCK_STREAM))[0]
+        vnc = socket.socket(family, socket.SOCK_STREAM)
+        vnc.setblocking(False)
+        vnc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        await loop.sock_connect(vnc, address)
+    except OSError as e:
+        if vnc is not None:
+            vnc.close()
+        print(f"❌ {peer[0]}: can't reach VNC server at {target[0]}:{target[1]} ({e})", flush=True)
+        await send_http(loop, client, "502 Bad Gateway", b"VNC server unreachable\n")
+        return
+    await loop.sock_sendall(client, ("\r\n".join(response) + "\r\n\r\n").encode())
+
+    next_connection_id += 1
+    connection_id = next_connection_id
+    stats = {"id": connection_id, "peer": f"{peer[0]}:{peer[1]}", "connected_at": time.time(),
+             "bytes_from_client": 0, "bytes_to_client": 0, "rtt_ms": None}
+    connections[connection_id] = stats
+    totals["connections"] += 1
+    print(f"🔌 Viewer #{connection_id} connected from {peer[0]} ({len(connections)} active)", flush=True)
+
+    send_lock = asyncio.Lock()
+    tasks = [asyncio.ensure_future(coro) for coro in (client_to_vnc(loop, client, vnc, stats, send_lock),
+                                                      vnc_to_client(loop, vnc, client, stats, send_lock),
+                                                      keepalive(loop, client, send_lock))]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        vnc.close()
+        del connections[connection_id]
+        print(f"👋 Viewer #{connection_id} disconnected ({stats['bytes_to_client']} bytes sent, "
+              f"{stats['bytes_from_client']} received)", flush=True)
+
+async def handle_connection(loop, client, peer, target, web_dir):
+    client.setblocking(False)
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        method, path, headers = await read_http_request(loop, client)
+        if headers.get("upgrade", "").lower() == "websocket" and "sec-websocket-key" in headers:
+            await handle_websocket(loop, client, headers, peer, target)
+        else:
+            await serve_static(loop, client, method, path, web_dir, is_local(peer, headers))
+    except (ConnectionError, OSError, ValueError):
+        pass
+    finally:
+        client.close()
+
+async def write_stats(path):
+    while True:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(stats_snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+        await asyncio.sleep(STATS_INTERVAL)
+
+async def serve(listen_port, target, web_dir=None, stats_file=None):
+    loop = asyncio.get_running_loop()
+    try:
+        server = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        server.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("::", listen_port))
+    except OSError:
+        # No IPv6 on this host
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("0.0.0.0", listen_port))
+    server.listen(128)
+    server.setblocking(False)
+    print(f"🌐 Proxying port {listen_port} -> {target[0]}:{target[1]}"
+          + (f", serving {web_dir}" if web_dir else ""), flush=True)
+    if stats_file:
+        asyncio.ensure_future(write_stats(stats_file))
+    while True:
+        client, peer = await loop.sock_accept(server)
+        asyncio.ensure_future(handle_connection(loop, client, peer, target, web_dir))
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket to VNC proxy serving noVNC")
+    parser.add_argument("--web", help="directory with the noVNC static files")
+    parser.add_argument("--stats-file", help="write connection stats as JSON to this file")
+    parser.add_argument("listen_port", type=int)
+    parser.add_argument("target", help="VNC server as HOST:PORT")
+    args = parser.parse_args()
+    host, port = args.target.rsplit(":", 1)
+    try:
+        asyncio.run(serve(args.listen_port, (host, int(port)), args.web, args.stats_file))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Edits single properties in XFCE's xfconf channel files.
+
+A channel file (~/.config/xfce4/xfconf/xfce-perchannel-xml/<channel>.xml)
+holds every setting of one program, the user's own included, so the
+performance profile never writes one whole: its properties are merged into
+whatever is there, and turning the profile off takes out only the ones it
+set. Properties are given as {"group/sub/name": (type, value)}, the path
+being the nesting of <property> elements in the file.
+"""
+import os
+import xml.etree.ElementTree as ET
+
+import config_files
+
+def load(path, channel):
+    try:
+        root = ET.parse(path).getroot()
+        if root.tag == "channel":
+            return root
+    except (OSError, ET.ParseError):
+        pass
+    return ET.Element("channel", name=channel, version="1.0")
+
+def render(root):
+    ET.indent(root, space="  ")
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode") + "\n"
+
+def find(parent, key, create=False):
+    """The <property> element at key under parent, or None"""
+    for name in key.split("/"):
+        node = next((child for child in parent.findall("property") if child.get("name") == name), None)
+        if node is None:
+            if not create:
+                return None
+            node = ET.SubElement(parent, "property", name=name, type="empty")
+        parent = node
+    return parent
+
+def has(path, properties):
+    """True if every property is set to the given type and value"""
+    root = load(path, "")
+    for key, (prop_type, value) in properties.items():
+        node = find(root, key)
+        if node is None or node.get("type") != prop_type or node.get("value") != str(value):
+            return False
+    return True
+
+def merge(path, channel, properties):
+    """Set the properties in the channel file, keeping everything else; True if it was written"""
+    root = load(path, channel)
+    for key, (prop_type, value) in properties.items():
+        node = find(root, key, create=True)
+        node.set("type", prop_type)
+        node.set("value", str(value))
+    return config_files.write_if_changed(path, render(root))
+
+def remove(path, properties):
+    """Take out the properties that still have the given value; True if the file changed.
+
+    Groups left empty go too, and so does the file if nothing is left in it.
+    """
+    if not os.path.exists(path):
+        return False
+    root = load(path, "")
+    removed = False
+    for key, (prop_type, value) in properties.items():
+        names = key.split("/")
+        chain = [root]
+        for name in names:
+            node = find(chain[-1], name)
+            if node is None:
+                break
+            chain.append(node)
+        else:
+            if chain[-1].get("type") != prop_type or chain[-1].get("value") != str(value):
+                continue    # changed since, so it's the user's now
+            chain[-2].remove(chain[-1])
+            removed = True
+            # Drop the groups this emptied, innermost first
+            for parent, node in zip(reversed(chain[:-2]), reversed(chain[1:-1])):
+                if len(node) or node.get("type") != "empty":
+                    break
+                parent.remove(node)
+    if not removed:
+        return False
+    if not len(root):
+        os.remove(path)
+        return True
+    return config_files.write_if_changed(path, render(root))